@@ -5,7 +5,7 @@ from datetime import datetime, timedelta, timezone
 from app.db.base import get_db
 from app.models.user import User, UserTier
 from app.schemas.user import UserCreate, UserLogin, TokenResponse, UserResponse
-from app.core.security import verify_password, get_password_hash, create_access_token, create_refresh_token, decode_token
+from app.core.security import verify_password, get_password_hash, password_needs_rehash, create_access_token, create_refresh_token, decode_token
 from app.core.token_blacklist import token_blacklist
 from app.core.config import settings
 from app.core.rate_limiting import limiter, RATE_LIMITS
@@ -257,6 +257,11 @@ async def login(
         # Success! Record it to reduce threat score
         await asr.record_success(client_ip, user_data.email, user_data.fingerprint)
         
+        # Move bcrypt (or outdated Argon2) hashes to the current parameters
+        if password_needs_rehash(user.password_hash):
+            user.password_hash = get_password_hash(user_data.password)
+            await db.commit()
+        
         # Check if user has 2FA enabled
         if user.two_factor_enabled:
             temp_token_data = {
@@ -721,7 +726,7 @@ async def forgot_password(
         return {"message": "If the email exists, a reset code has been sent"}
     
     # Generate 6-digit code
-    reset_code = str(secrets.randbelow(900000) + 100000)  # Ensures 6 digits
+    reset_code = EmailService.generate_reset_code()
     
     # Store in Redis with 15 minute expiry
     await redis_client.setex(
@@ -14,9 +14,8 @@ from app.services.storage import storage_service
 from app.utils.files import generate_short_code, generate_stored_filename
 from app.core.config import settings
 from app.core.security import get_password_hash
-from app.core.validators import FileValidator, FilenameValidator
+from app.core.validators import FileValidator, FilenameValidator, get_mime_detector
 from app.core.rate_limiting import limiter, RATE_LIMITS
-import magic
 import asyncio
 import json
 import zipfile
@@ -107,8 +106,7 @@ async def upload_batch(
                 continue
             
             # Detect MIME type
-            mime = magic.Magic(mime=True)
-            mime_type = mime.from_buffer(file_content)
+            mime_type = get_mime_detector().from_buffer(file_content)
             
             # Generate file identifiers
             short_code = generate_short_code()
@@ -311,8 +309,7 @@ async def upload_folder(
                         continue
                     
                     # Detect MIME type
-                    mime = magic.Magic(mime=True)
-                    mime_type = mime.from_buffer(file_content)
+                    mime_type = get_mime_detector().from_buffer(file_content)
                     
                     # Generate identifiers
                     short_code = generate_short_code()
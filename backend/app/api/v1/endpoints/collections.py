@@ -632,6 +632,11 @@ async def download_collection_zip(
     
     with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
         from app.services.storage import storage_service
+        from app.core.encryption import file_encryption
+        
+        # Derive every file key in one batch instead of one per download
+        if file_encryption:
+            await file_encryption.prime_ciphers([file.stored_filename for file, _ in files_data])
         
         for file, path in files_data:
             try:
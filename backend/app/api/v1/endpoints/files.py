@@ -4,7 +4,6 @@ from sqlalchemy import select, func, update, and_, delete
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any
 from uuid import UUID
-import magic
 from app.db.base import get_db
 from app.models.file import File
 from app.models.user import User
@@ -12,7 +11,7 @@ from app.schemas.file import FileListResponse, FileInfo, FileUploadResponse
 from app.api.deps import require_user
 from app.services.storage import storage_service
 from app.utils.files import generate_stored_filename
-from app.core.validators import FileValidator, FilenameValidator
+from app.core.validators import FileValidator, FilenameValidator, get_mime_detector
 
 router = APIRouter()
 
@@ -244,8 +243,7 @@ async def replace_file(
         )
     
     # Detect MIME type
-    mime = magic.Magic(mime=True)
-    mime_type = mime.from_buffer(file_content)
+    mime_type = get_mime_detector().from_buffer(file_content)
     
     # Generate new stored filename
     stored_filename = generate_stored_filename(safe_filename)
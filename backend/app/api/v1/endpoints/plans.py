@@ -105,7 +105,7 @@ async def get_current_plan(
                 "daily_transfers_used": 0,
                 "daily_transfers_limit": limits["daily_transfer_limit"],
             },
-            "limits": limits
+            "limits": dict(limits)
         }
     
     # Check if transfer reset is needed (monthly reset)
@@ -151,5 +151,5 @@ async def get_current_plan(
             "daily_transfers_used": daily_transfers_used,
             "daily_transfers_limit": limits["daily_transfer_limit"],
         },
-        "limits": limits
+        "limits": dict(limits)
     }
\ No newline at end of file
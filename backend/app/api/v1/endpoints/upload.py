@@ -12,14 +12,12 @@ from app.services.storage import storage_service
 from app.utils.files import generate_short_code, generate_stored_filename
 from app.core.config import settings
 from app.core.security import get_password_hash
-from app.core.validators import FileValidator, FilenameValidator
+from app.core.validators import FileValidator, FilenameValidator, get_mime_detector
 from app.core.rate_limiting import limiter, RATE_LIMITS
 from app.core.plan_limits import get_plan_limits
 from app.core.virus_scanner import virus_scanner
 from app.core.streaming import StreamingFileHandler, ChunkedStorageUploader
-import magic
 import os
-import aiofiles
 
 router = APIRouter()
 
@@ -180,8 +178,7 @@ async def upload_anonymous(
         )
     
     # Detect MIME type
-    mime = magic.Magic(mime=True)
-    mime_type = mime.from_buffer(file_content)
+    mime_type = get_mime_detector().from_buffer(file_content)
     
     # Generate file identifiers
     short_code = generate_short_code()
@@ -274,7 +271,7 @@ async def upload_authenticated(
         file_size_limit = plan_limits["max_file_size_bytes"]
         
         # Process upload stream
-        temp_path, file_size, mime_type, first_chunk = await StreamingFileHandler.process_upload_stream(
+        temp_path, file_size, mime_type, first_chunk, file_data = await StreamingFileHandler.process_upload_stream(
             file,
             file_size_limit
         )
@@ -290,7 +287,7 @@ async def upload_authenticated(
         
         # Validate file type using streaming validation
         is_valid, error_msg = await StreamingFileHandler.validate_file_stream(
-            temp_path, safe_filename, mime_type, first_chunk
+            temp_path, safe_filename, mime_type, first_chunk, file_data
         )
         if not is_valid:
             raise HTTPException(
@@ -298,11 +295,9 @@ async def upload_authenticated(
                 detail=error_msg
             )
         
-        # For small files, do virus scan
-        if file_size < StreamingFileHandler.MAX_MEMORY_SIZE:
-            async with aiofiles.open(temp_path, 'rb') as f:
-                file_content = await f.read()
-            is_clean, threat_name = await virus_scanner.scan_file(file_content, safe_filename)
+        # For small files (kept in memory by the stream handler), do virus scan
+        if file_data is not None:
+            is_clean, threat_name = await virus_scanner.scan_file(file_data, safe_filename)
             if not is_clean:
                 raise HTTPException(
                     status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -318,7 +313,8 @@ async def upload_authenticated(
             storage_service,
             temp_path,
             stored_filename,
-            mime_type
+            mime_type,
+            file_data=file_data
         )
         
         if not upload_success:
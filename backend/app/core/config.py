@@ -15,12 +15,21 @@ class Settings(BaseSettings):
     JWT_EXPIRATION_HOURS: int = 1
     JWT_REFRESH_EXPIRATION_DAYS: int = 30
     SENDGRID_API_KEY: str = ""
+    SMTP_HOST: str = ""  # Leave empty to disable outgoing email
+    SMTP_PORT: int = 465
+    SMTP_USERNAME: str = ""
+    SMTP_PASSWORD: str = ""
+    SMTP_FROM: str = "SecureShare Pro <noreply@znapfile.com>"
+    SMTP_POOL_SIZE: int = 5
+    SMTP_POOL_MIN: int = 1  # Connections opened at startup
     STRIPE_SECRET_KEY: str = ""
     STRIPE_PRO_PRICE_ID: str = ""
     STRIPE_MAX_PRICE_ID: str = ""
     STRIPE_WEBHOOK_SECRET: str = ""
     SENTRY_DSN: str = ""
     ENCRYPTION_MASTER_KEY: str = ""
+    FILE_CIPHER_CACHE: int = 100_000  # Per-process cap on cached file ciphers
+    AUDIT_CHAIN_LOG: str = ""  # Append-only audit block log; empty keeps only recent blocks in memory
     VIRUS_SCAN_ENABLED: bool = False
     VIRUS_SCAN_SERVICE: str = "disabled"  # "clamav", "virustotal", or "disabled"
     VIRUS_SCAN_API_URL: str = ""  # e.g., "http://localhost:8080" for ClamAV
@@ -30,6 +39,7 @@ class Settings(BaseSettings):
     DEBUG: bool = False
     ENVIRONMENT: str = "development"
     FRONTEND_URL: str = "http://localhost:5173"
+    JINJA_BYTECODE_DIR: str = ""  # Compiled email templates; empty uses Jinja's per-user cache dir
     
     FREE_FILE_SIZE_LIMIT: int = 100 * 1024 * 1024  # 100MB
     FREE_STORAGE_LIMIT: int = 500 * 1024 * 1024  # 500MB
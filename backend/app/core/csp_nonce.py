@@ -35,6 +35,7 @@ class CSPNonce:
         directives = {
             "default-src": "'self'",
             "script-src": f"'self' 'nonce-{nonce}'",
+            "worker-src": "'self' blob:",
             "style-src": f"'self' 'nonce-{nonce}'",
             "img-src": "'self' data: https:",
             "font-src": "'self'",
@@ -2,15 +2,243 @@
 Adaptive Security Response (ASR) System
 Protects against brute force attacks with escalating challenges
 """
+import asyncio
+import base64
 import hashlib
+import functools
+import logging
+import os
 import time
 import secrets
-import json
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 import redis.asyncio as redis
+from cachetools import TTLCache
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected
+_background_tasks = set()
+
+# Per-process threat levels; collapses repeated lookups from an attacking IP
+_threat_cache = TTLCache(maxsize=10000, ttl=1.0)
+
+# Redis key prefixes (redis-py sends bytes keys as-is)
+_K_IP = b"asr:attempts:ip:"
+_K_EMAIL = b"asr:attempts:email:"
+_K_FP = b"asr:attempts:fp:"
+_K_BLOCKED = b"asr:blocked:"
+_K_CHALLENGE = b"asr:challenge:"
+
+# Client-side PoW solver: nonces hashed per progress update
+POW_BATCH_SIZE = 4096
+
+# (bytes to read, bits to shift off) per PoW difficulty in hex nibbles
+_ZERO_NIBBLE_MASKS = tuple(
+    ((4 * d + 7) // 8, 8 * ((4 * d + 7) // 8) - 4 * d) for d in range(9)
+)
+
+# First-party SHA-256 nonce search shipped with the solver, so the login challenge
+# never runs code fetched from a third party. Self-contained (no outer references)
+# because the worker source is built from its toString()
+_POW_JS_SEARCHER = """
+    function powSearcher(challenge, difficulty, start, stride) {
+        const K = new Uint32Array([
+            0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+            0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+            0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+            0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+            0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+            0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+            0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+            0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+        ]);
+        const W = new Uint32Array(64);
+        const prefix = new TextEncoder().encode(challenge);
+        // Room for the prefix, up to 20 nonce digits and the SHA-256 padding
+        const buf = new Uint8Array(Math.ceil((prefix.length + 29) / 64) * 64);
+        buf.set(prefix);
+        const zeroBits = difficulty * 4;
+        let nonce = start;
+        
+        // First 32 bits of SHA-256(buf[0:len]), enough for up to 8 zero nibbles
+        function head(len) {
+            buf.fill(0, len);
+            buf[len] = 0x80;
+            const end = ((len + 72) >> 6) << 6;
+            const bits = len * 8;
+            buf[end - 4] = bits >>> 24;
+            buf[end - 3] = (bits >>> 16) & 255;
+            buf[end - 2] = (bits >>> 8) & 255;
+            buf[end - 1] = bits & 255;
+            
+            let h0 = 0x6a09e667, h1 = 0xbb67ae85, h2 = 0x3c6ef372, h3 = 0xa54ff53a;
+            let h4 = 0x510e527f, h5 = 0x9b05688c, h6 = 0x1f83d9ab, h7 = 0x5be0cd19;
+            for (let off = 0; off < end; off += 64) {
+                for (let t = 0; t < 16; t++) {
+                    const o = off + t * 4;
+                    W[t] = (buf[o] << 24) | (buf[o + 1] << 16) | (buf[o + 2] << 8) | buf[o + 3];
+                }
+                for (let t = 16; t < 64; t++) {
+                    const w15 = W[t - 15], w2 = W[t - 2];
+                    const s0 = ((w15 >>> 7) | (w15 << 25)) ^ ((w15 >>> 18) | (w15 << 14)) ^ (w15 >>> 3);
+                    const s1 = ((w2 >>> 17) | (w2 << 15)) ^ ((w2 >>> 19) | (w2 << 13)) ^ (w2 >>> 10);
+                    W[t] = (W[t - 16] + s0 + W[t - 7] + s1) | 0;
+                }
+                let a = h0, b = h1, c = h2, d = h3, e = h4, f = h5, g = h6, h = h7;
+                for (let t = 0; t < 64; t++) {
+                    const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+                    const t1 = (h + S1 + ((e & f) ^ (~e & g)) + K[t] + W[t]) | 0;
+                    const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+                    const t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+                    h = g; g = f; f = e; e = (d + t1) | 0;
+                    d = c; c = b; b = a; a = (t1 + t2) | 0;
+                }
+                h0 = (h0 + a) | 0; h1 = (h1 + b) | 0; h2 = (h2 + c) | 0; h3 = (h3 + d) | 0;
+                h4 = (h4 + e) | 0; h5 = (h5 + f) | 0; h6 = (h6 + g) | 0; h7 = (h7 + h) | 0;
+            }
+            return h0 >>> 0;
+        }
+        
+        // Hash up to size nonces (nonce, nonce + stride, ...); the solution or -1
+        return function batch(size) {
+            for (let i = 0; i < size; i++, nonce += stride) {
+                const digits = String(nonce);
+                for (let j = 0; j < digits.length; j++) {
+                    buf[prefix.length + j] = digits.charCodeAt(j);
+                }
+                const value = head(prefix.length + digits.length);
+                if (zeroBits === 0 || (value >>> (32 - zeroBits)) === 0) {
+                    return nonce;
+                }
+            }
+            return -1;
+        };
+    }
+"""
+
+# Solver script, formatted per challenge with %-style named fields
+_POW_JS_TEMPLATE = """
+    async function solveChallenge() {
+        const challenge = "%(challenge)s";
+        const difficulty = %(difficulty)d;
+        const batchSize = %(batch_size)d;
+        const workerCount = Math.max(1, navigator.hardwareConcurrency || 1);
+        
+        let attempts = 0;
+        const startTime = Date.now();
+        
+        // Update UI
+        const statusEl = document.getElementById('challenge-status');
+        if (statusEl) statusEl.textContent = 'Solving security challenge...';
+        const progress = (count) => {
+            attempts += count;
+            if (statusEl) {
+                statusEl.textContent = `Solving challenge... (${(attempts/1000).toFixed(0)}k attempts)`;
+            }
+        };
+        
+        // Each worker searches nonces where nonce %% stride === start
+        const solveInWorkers = () => new Promise((resolve, reject) => {
+            const workerSrc = powSearcher.toString() + `
+                self.onmessage = (event) => {
+                    const { challenge, difficulty, start, stride, batchSize } = event.data;
+                    const batch = powSearcher(challenge, difficulty, start, stride);
+                    
+                    while (true) {
+                        const nonce = batch(batchSize);
+                        if (nonce >= 0) {
+                            self.postMessage({ done: true, nonce });
+                            return;
+                        }
+                        self.postMessage({ done: false, attempts: batchSize });
+                    }
+                };
+            `;
+            const workerUrl = URL.createObjectURL(new Blob([workerSrc], { type: 'text/javascript' }));
+            const workers = [];
+            const finish = () => {
+                workers.forEach(worker => worker.terminate());
+                URL.revokeObjectURL(workerUrl);
+            };
+            
+            try {
+                for (let id = 0; id < workerCount; id++) {
+                    const worker = new Worker(workerUrl);
+                    workers.push(worker);
+                    worker.onmessage = (event) => {
+                        if (event.data.done) {
+                            finish();
+                            resolve(event.data.nonce);
+                            return;
+                        }
+                        progress(event.data.attempts);
+                    };
+                    // Also fires when a CSP without worker-src blob: refuses the script
+                    worker.onerror = (error) => {
+                        finish();
+                        reject(error);
+                    };
+                    worker.postMessage({ challenge, difficulty, start: id, stride: workerCount, batchSize });
+                }
+            } catch (error) {
+                finish();
+                reject(error);
+            }
+        });
+        
+        // Same search on the page itself, yielding between batches so the UI updates
+        const solveOnMainThread = async () => {
+            const batch = powSearcher(challenge, difficulty, 0, 1);
+            while (true) {
+                const nonce = batch(batchSize);
+                if (nonce >= 0) return nonce;
+                progress(batchSize);
+                await new Promise(r => setTimeout(r, 0));
+            }
+        };
+        
+        let nonce;
+        try {
+            nonce = await solveInWorkers();
+        } catch (error) {
+            console.warn('PoW workers unavailable, solving on the main thread', error);
+            nonce = await solveOnMainThread();
+        }
+        
+        const timeSpent = (Date.now() - startTime) / 1000;
+        console.log(`Challenge solved in ${timeSpent}s with nonce: ${nonce}`);
+        return nonce.toString();
+    }
+"""
+
+# HGETALL + DEL as a single script so concurrent verifies can't both pass
+_CONSUME_CHALLENGE_LUA = """
+local v = redis.call('HGETALL', KEYS[1])
+if #v > 0 then redis.call('DEL', KEYS[1]) end
+return v
+"""
+
+
+@functools.lru_cache(maxsize=4096)
+def _email_key(email: str) -> str:
+    """Hashed, case-insensitive email identifier used in Redis keys"""
+    return hashlib.sha256(email.lower().encode()).hexdigest()[:16]
+
+
+def _urlsafe(raw: bytes) -> str:
+    """Unpadded URL-safe base64, same format as secrets.token_urlsafe"""
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _on_background_done(task: asyncio.Task):
+    """Drop finished background task and log any failure"""
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.warning(f"ASR background update failed: {task.exception()}")
+
+
 class AdaptiveSecurityResponse:
     """
     ASR - Multi-layered defense system that adapts to threat levels
@@ -20,6 +248,9 @@ class AdaptiveSecurityResponse:
         self.redis = redis_client
         self.challenge_ttl = 60  # 60 seconds
         
+        # Read and delete a challenge in one atomic step (prevents replay races)
+        self._consume_challenge = self.redis.register_script(_CONSUME_CHALLENGE_LUA)
+        
         # Defense escalation levels - simplified
         self.levels = [
             {"attempts": 0, "action": "none", "difficulty": 0},
@@ -34,38 +265,37 @@ class AdaptiveSecurityResponse:
     
     async def get_threat_level(self, identifier: str) -> Dict:
         """Get current threat level for an identifier (IP, email, fingerprint)"""
-        # Get failed attempts from multiple identifiers
-        attempts = 0
+        cached = _threat_cache.get(identifier)
+        if cached is not None:
+            return cached
         
-        # Check by IP
-        ip_attempts = await self.redis.get(f"asr:attempts:ip:{identifier}")
-        if ip_attempts:
-            attempts = max(attempts, int(ip_attempts))
+        # IP, email and fingerprint counters plus the block flag in one MGET
+        ident = identifier.encode()
+        *counts, blocked = await self.redis.mget(
+            _K_IP + ident, _K_EMAIL + ident, _K_FP + ident, _K_BLOCKED + ident
+        )
         
-        # Check by email/username pattern
-        email_attempts = await self.redis.get(f"asr:attempts:email:{identifier}")
-        if email_attempts:
-            attempts = max(attempts, int(email_attempts))
-        
-        # Check by browser fingerprint
-        fp_attempts = await self.redis.get(f"asr:attempts:fp:{identifier}")
-        if fp_attempts:
-            attempts = max(attempts, int(fp_attempts))
+        # Get failed attempts from multiple identifiers
+        attempts = max((int(count) for count in counts if count), default=0)
         
         # Check if blocked
-        if await self.redis.get(f"asr:blocked:{identifier}"):
-            return {"action": "blocked", "attempts": attempts}
-        
-        # Find appropriate defense level
-        for level in reversed(self.levels):
-            if attempts >= level["attempts"]:
-                return {
-                    "action": level["action"],
-                    "difficulty": level["difficulty"],
-                    "attempts": attempts
-                }
+        if blocked:
+            result = {"action": "blocked", "attempts": attempts}
+        else:
+            result = {"action": "none", "difficulty": 0, "attempts": 0}
+            
+            # Find appropriate defense level
+            for level in reversed(self.levels):
+                if attempts >= level["attempts"]:
+                    result = {
+                        "action": level["action"],
+                        "difficulty": level["difficulty"],
+                        "attempts": attempts
+                    }
+                    break
         
-        return {"action": "none", "difficulty": 0, "attempts": 0}
+        _threat_cache[identifier] = result
+        return result
     
     async def record_failure(self, ip: str, email: str = None, fingerprint: str = None):
         """Record a failed login attempt"""
@@ -73,43 +303,69 @@ class AdaptiveSecurityResponse:
         pipe = self.redis.pipeline()
         
         # IP-based tracking
-        pipe.incr(f"asr:attempts:ip:{ip}")
-        pipe.expire(f"asr:attempts:ip:{ip}", 86400)  # 24 hour window
+        ip_key = _K_IP + ip.encode()
+        pipe.incr(ip_key)
+        pipe.expire(ip_key, 86400)  # 24 hour window
         
         # Email-based tracking (hashed)
         if email:
-            email_hash = hashlib.sha256(email.lower().encode()).hexdigest()[:16]
-            pipe.incr(f"asr:attempts:email:{email_hash}")
-            pipe.expire(f"asr:attempts:email:{email_hash}", 86400)
+            email_hash = _email_key(email)
+            email_key = _K_EMAIL + email_hash.encode()
+            pipe.incr(email_key)
+            pipe.expire(email_key, 86400)
         
         # Fingerprint-based tracking
         if fingerprint:
-            pipe.incr(f"asr:attempts:fp:{fingerprint}")
-            pipe.expire(f"asr:attempts:fp:{fingerprint}", 86400)
+            fp_key = _K_FP + fingerprint.encode()
+            pipe.incr(fp_key)
+            pipe.expire(fp_key, 86400)
         
         await pipe.execute()
+        self._invalidate_threat_cache(ip, email_hash if email else None, fingerprint)
         
         # Check if we need to block
         threat_level = await self.get_threat_level(ip)
         if threat_level["action"] == "permanent_block":
-            await self.redis.setex(f"asr:blocked:{ip}", 86400 * 30, "1")  # 30 day block
+            await self.redis.setex(_K_BLOCKED + ip.encode(), 86400 * 30, "1")  # 30 day block
+            _threat_cache.pop(ip, None)
     
     async def record_success(self, ip: str, email: str = None, fingerprint: str = None):
         """Record successful login - reduces threat score"""
+        email_hash = _email_key(email) if email else None
+        counters = [
+            _K_IP + ip.encode(),
+            _K_EMAIL + email_hash.encode() if email_hash else None,
+            _K_FP + fingerprint.encode() if fingerprint else None
+        ]
+        identifiers = (ip, email_hash, fingerprint)
+        
+        # A stale counter doesn't weaken security, so don't hold the response for it
+        task = asyncio.create_task(
+            self._decrement_counters([counter for counter in counters if counter], identifiers)
+        )
+        _background_tasks.add(task)
+        task.add_done_callback(_on_background_done)
+    
+    def _invalidate_threat_cache(self, *identifiers: Optional[str]):
+        """Drop cached threat levels so counter changes are seen immediately"""
+        for identifier in identifiers:
+            if identifier:
+                _threat_cache.pop(identifier, None)
+    
+    async def _decrement_counters(self, counters: List[bytes],
+                                  identifiers: Tuple[Optional[str], ...]):
+        """Decrement attempt counters (but don't go below 0), then drop their cached levels"""
         pipe = self.redis.pipeline()
         
-        # Decrement counters (but don't go below 0)
-        for key in [
-            f"asr:attempts:ip:{ip}",
-            f"asr:attempts:email:{hashlib.sha256(email.lower().encode()).hexdigest()[:16]}" if email else None,
-            f"asr:attempts:fp:{fingerprint}" if fingerprint else None
-        ]:
-            if key:
-                current = await self.redis.get(key)
+        try:
+            for key, current in zip(counters, await self.redis.mget(counters)):
                 if current and int(current) > 0:
                     pipe.decr(key)
-        
-        await pipe.execute()
+            
+            await pipe.execute()
+        finally:
+            # Evict only now, so a lookup racing the decrement can't re-cache the old level
+            self._invalidate_threat_cache(*identifiers)
     
     async def create_challenge(self, identifier: str) -> Optional[Dict]:
         """Create appropriate challenge based on threat level"""
@@ -126,14 +382,14 @@ class AdaptiveSecurityResponse:
             a = secrets.randbelow(10) + 1
             b = secrets.randbelow(10) + 1
             answer = a + b
-            challenge_id = secrets.token_urlsafe(16)
+            challenge_id = _urlsafe(os.urandom(16))
             
             # Store answer
-            await self.redis.setex(
-                f"asr:challenge:{challenge_id}",
-                self.challenge_ttl,
-                json.dumps({"answer": str(answer), "type": "math"})
-            )
+            key = _K_CHALLENGE + challenge_id.encode()
+            pipe = self.redis.pipeline()
+            pipe.hset(key, mapping={"answer": answer, "type": "math"})
+            pipe.expire(key, self.challenge_ttl)
+            await pipe.execute()
             
             return {
                 "type": "math",
@@ -144,21 +400,23 @@ class AdaptiveSecurityResponse:
         
         if threat["action"] == "proof_of_work":
             # Proof of Work challenge
-            challenge = secrets.token_urlsafe(32)
+            # One urandom read for both the challenge and its id
+            raw = os.urandom(48)
+            challenge = _urlsafe(raw[:32])
             difficulty = threat["difficulty"]
-            challenge_id = secrets.token_urlsafe(16)
+            challenge_id = _urlsafe(raw[32:])
             
             # Store challenge
-            await self.redis.setex(
-                f"asr:challenge:{challenge_id}",
-                self.challenge_ttl,
-                json.dumps({
-                    "challenge": challenge,
-                    "difficulty": difficulty,
-                    "type": "pow",
-                    "created": time.time()
-                })
-            )
+            key = _K_CHALLENGE + challenge_id.encode()
+            pipe = self.redis.pipeline()
+            pipe.hset(key, mapping={
+                "challenge": challenge,
+                "difficulty": difficulty,
+                "type": "pow",
+                "created": time.time()
+            })
+            pipe.expire(key, self.challenge_ttl)
+            await pipe.execute()
             
             return {
                 "type": "proof_of_work",
@@ -182,32 +440,30 @@ class AdaptiveSecurityResponse:
         if not challenge_id or not solution:
             return False
         
-        # Get challenge from Redis
-        challenge_data = await self.redis.get(f"asr:challenge:{challenge_id}")
-        if not challenge_data:
-            return False
-        
         try:
-            data = json.loads(challenge_data)
+            # Get and consume challenge from Redis (prevents replay attacks);
+            # a challenge still stored as a JSON string fails WRONGTYPE and is rejected
+            fields = await self._consume_challenge(keys=[_K_CHALLENGE + challenge_id.encode()])
+            if not fields:
+                return False
             
-            # Prevent replay attacks
-            await self.redis.delete(f"asr:challenge:{challenge_id}")
+            data = dict(zip(fields[::2], fields[1::2]))
             
             if data["type"] == "math":
-                return solution == data["answer"]
+                return solution == str(data["answer"])
             
             elif data["type"] == "pow":
                 # Verify proof of work
                 challenge = data["challenge"]
-                difficulty = data["difficulty"]
+                difficulty = int(data["difficulty"])
                 
                 # Check if solution produces required hash
-                hash_input = f"{challenge}{solution}"
-                hash_output = hashlib.sha256(hash_input.encode()).hexdigest()
-                
-                # Check if hash has required leading zeros
-                required_prefix = "0" * difficulty
-                return hash_output.startswith(required_prefix)
+                digest = hashlib.sha256(challenge.encode() + solution.encode()).digest()
+
+                # Check if hash has required leading zero nibbles
+                head_len, shift = _ZERO_NIBBLE_MASKS[difficulty]
+                head = int.from_bytes(digest[:head_len], "big")
+                return (head >> shift) == 0
             
         except Exception:
             return False
@@ -217,41 +473,9 @@ class AdaptiveSecurityResponse:
     async def get_client_challenge_script(self, challenge: Dict) -> Optional[str]:
         """Generate client-side JavaScript for solving challenges"""
         if challenge["type"] == "proof_of_work":
-            return f"""
-            async function solveChallenge() {{
-                const challenge = "{challenge['challenge']}";
-                const difficulty = {challenge['difficulty']};
-                const requiredPrefix = "0".repeat(difficulty);
-                
-                let nonce = 0;
-                const startTime = Date.now();
-                
-                // Update UI
-                const statusEl = document.getElementById('challenge-status');
-                if (statusEl) statusEl.textContent = 'Solving security challenge...';
-                
-                while (true) {{
-                    const hash = await crypto.subtle.digest(
-                        'SHA-256',
-                        new TextEncoder().encode(challenge + nonce)
-                    );
-                    const hashHex = Array.from(new Uint8Array(hash))
-                        .map(b => b.toString(16).padStart(2, '0'))
-                        .join('');
-                    
-                    if (hashHex.startsWith(requiredPrefix)) {{
-                        const timeSpent = (Date.now() - startTime) / 1000;
-                        console.log(`Challenge solved in ${{timeSpent}}s with nonce: ${{nonce}}`);
-                        return nonce.toString();
-                    }}
-                    
-                    nonce++;
-                    
-                    // Update progress every 1000 iterations
-                    if (nonce % 1000 === 0 && statusEl) {{
-                        statusEl.textContent = `Solving challenge... (${{(nonce/1000).toFixed(0)}}k attempts)`;
-                    }}
-                }}
-            }}
-            """
+            return _POW_JS_SEARCHER + _POW_JS_TEMPLATE % {
+                "challenge": challenge["challenge"],
+                "difficulty": challenge["difficulty"],
+                "batch_size": POW_BATCH_SIZE,
+            }
         return None
\ No newline at end of file
@@ -5,6 +5,12 @@ import hashlib
 from typing import Optional, Dict
 from datetime import datetime, timedelta
 
+
+def _hash_token(token: str) -> str:
+    """Internal lookup key for a token (never leaves this process)"""
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+
 class DownloadTokenManager:
     def __init__(self, secret_key: str):
         self.secret_key = secret_key
@@ -14,7 +20,7 @@ class DownloadTokenManager:
     def create_download_token(self, file_id: str, user_ip: str, password_verified: bool = False) -> str:
         """Create a single-use download token"""
         token = secrets.token_urlsafe(32)
-        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        token_hash = _hash_token(token)
         
         self.tokens[token_hash] = {
             'file_id': file_id,
@@ -34,7 +40,7 @@ class DownloadTokenManager:
         if not token:
             return False
             
-        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        token_hash = _hash_token(token)
         token_data = self.tokens.get(token_hash)
         
         if not token_data:
@@ -68,7 +74,7 @@ class DownloadTokenManager:
         if not token:
             return None
             
-        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        token_hash = _hash_token(token)
         return self.tokens.get(token_hash)
     
     def _cleanup_expired(self):
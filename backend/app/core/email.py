@@ -1,14 +1,451 @@
-from typing import Optional
+from typing import List, Optional, Tuple
+import asyncio
+import functools
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
+import stat
+from email.message import EmailMessage
+import os
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from jinja2 import DictLoader, Environment, FileSystemBytecodeCache, Template
 from app.core.config import settings
+from app.core.smtp_pool import BatchAbort, async_smtp, smtp_pool
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Dev-mode links and codes are logged through a queue, so the blocking stream
+# write happens on the listener thread instead of the request
+if settings.ENVIRONMENT == "development":
+    _log_queue = queue.SimpleQueue()
+    _log_listener = QueueListener(_log_queue, logging.StreamHandler())
+    logger.addHandler(QueueHandler(_log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+VERIFY_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+            background-color: #0f0f0f;
+            color: #e0e0e0;
+            margin: 0;
+            padding: 0;
+        }
+        .container {
+            max-width: 600px;
+            margin: 0 auto;
+            padding: 40px 20px;
+        }
+        .card {
+            background: linear-gradient(135deg, #1a1a1a 0%, #2d2d2d 100%);
+            border-radius: 16px;
+            padding: 40px;
+            box-shadow: 0 10px 30px rgba(0,0,0,0.5);
+            border: 1px solid #333;
+        }
+        .logo {
+            text-align: center;
+            margin-bottom: 30px;
+        }
+        h1 {
+            background: linear-gradient(135deg, #3b82f6 0%, #8b5cf6 100%);
+            -webkit-background-clip: text;
+            -webkit-text-fill-color: transparent;
+            font-size: 28px;
+            margin: 0 0 20px 0;
+            text-align: center;
+        }
+        .content {
+            line-height: 1.6;
+            color: #b0b0b0;
+            margin-bottom: 30px;
+        }
+        .button {
+            display: inline-block;
+            background: linear-gradient(135deg, #3b82f6 0%, #8b5cf6 100%);
+            color: white;
+            padding: 14px 32px;
+            text-decoration: none;
+            border-radius: 8px;
+            font-weight: 600;
+            text-align: center;
+            margin: 20px auto;
+            display: block;
+            width: fit-content;
+            box-shadow: 0 4px 15px rgba(59, 130, 246, 0.4);
+            transition: all 0.3s ease;
+        }
+        .footer {
+            text-align: center;
+            color: #666;
+            font-size: 14px;
+            margin-top: 40px;
+        }
+        .magic {
+            background: linear-gradient(90deg, #3b82f6, #8b5cf6, #ec4899, #3b82f6);
+            background-size: 300% 100%;
+            -webkit-background-clip: text;
+            -webkit-text-fill-color: transparent;
+            animation: gradient 3s ease infinite;
+        }
+        @keyframes gradient {
+            0% { background-position: 0% 50%; }
+            50% { background-position: 100% 50%; }
+            100% { background-position: 0% 50%; }
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="card">
+"""
+
+VERIFY_BODY = """            <div class="logo">
+                <div style="font-size: 48px;">☁️</div>
+            </div>
+            <h1>Welcome to SecureShare Pro!</h1>
+            <div class="content">
+                <p>Hi there! 👋</p>
+                <p>Thanks for signing up for SecureShare Pro. You're just one click away from unlocking secure, lightning-fast file sharing.</p>
+                <p>Please verify your email address to get started:</p>
+            </div>
+            <a href="{{ base_url }}/verify-email?token={{ token }}" class="button">
+                ✨ Verify Email Address
+            </a>
+            <div class="content">
+                <p style="font-size: 14px; color: #666;">
+                    This link will expire in 24 hours. If you didn't sign up for SecureShare Pro, you can safely ignore this email.
+                </p>
+            </div>
+            <div class="footer">
+                <p class="magic">✨ Secure • Fast • Magical ✨</p>
+                <p style="color: #555;">© 2024 SecureShare Pro. All rights reserved.</p>
+            </div>
+"""
+
+RESET_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+            background-color: #0a0a0a;
+            color: #e0e0e0;
+            margin: 0;
+            padding: 0;
+        }
+        .container {
+            max-width: 600px;
+            margin: 0 auto;
+            padding: 40px 20px;
+        }
+        .card {
+            background: linear-gradient(135deg, #1a1a1a 0%, #2d2d2d 100%);
+            border-radius: 16px;
+            padding: 40px;
+            box-shadow: 0 10px 30px rgba(0,0,0,0.5);
+            border: 1px solid #333;
+        }
+        .logo {
+            text-align: center;
+            margin-bottom: 30px;
+        }
+        h1 {
+            background: linear-gradient(135deg, #3b82f6 0%, #8b5cf6 100%);
+            -webkit-background-clip: text;
+            -webkit-text-fill-color: transparent;
+            font-size: 28px;
+            margin: 0 0 20px 0;
+            text-align: center;
+        }
+        .code-box {
+            background: #0a0a0a;
+            border: 2px solid #3b82f6;
+            border-radius: 12px;
+            padding: 30px;
+            text-align: center;
+            margin: 30px 0;
+        }
+        .code {
+            font-size: 48px;
+            font-weight: bold;
+            letter-spacing: 12px;
+            color: #3b82f6;
+            font-family: 'Courier New', monospace;
+        }
+        .content {
+            line-height: 1.6;
+            color: #b0b0b0;
+            margin-bottom: 20px;
+        }
+        .footer {
+            text-align: center;
+            color: #666;
+            font-size: 14px;
+            margin-top: 40px;
+        }
+        .warning {
+            background: rgba(239, 68, 68, 0.1);
+            border: 1px solid rgba(239, 68, 68, 0.3);
+            border-radius: 8px;
+            padding: 15px;
+            margin: 20px 0;
+            color: #fca5a5;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="card">
+"""
+
+RESET_BODY = """            <div class="logo">
+                <div style="font-size: 48px;">🔐</div>
+            </div>
+            <h1>Password Reset Request</h1>
+            <div class="content">
+                <p>Hi there,</p>
+                <p>We received a request to reset your SecureShare Pro password. Use the code below to reset your password:</p>
+            </div>
+            <div class="code-box">
+                <div class="code">{{ code }}</div>
+            </div>
+            <div class="content">
+                <p><strong>This code expires in 15 minutes.</strong></p>
+                <p>Enter this code on the password reset page to create a new password.</p>
+            </div>
+            <div class="warning">
+                <p><strong>⚠️ Security Notice:</strong></p>
+                <p>If you didn't request this password reset, please ignore this email. Your password will remain unchanged.</p>
+            </div>
+            <div class="footer">
+                <p style="color: #555;">© 2024 SecureShare Pro. All rights reserved.</p>
+            </div>
+"""
+
+SHARE_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+            background-color: #f5f5f5;
+            color: #333;
+            margin: 0;
+            padding: 0;
+        }
+        .container {
+            max-width: 600px;
+            margin: 0 auto;
+            padding: 40px 20px;
+        }
+        .card {
+            background: white;
+            border-radius: 16px;
+            padding: 40px;
+            box-shadow: 0 4px 20px rgba(0,0,0,0.1);
+        }
+        .header {
+            text-align: center;
+            margin-bottom: 30px;
+        }
+        .logo {
+            font-size: 48px;
+            margin-bottom: 10px;
+        }
+        h1 {
+            color: #8B5CF6;
+            font-size: 28px;
+            margin: 0 0 30px 0;
+        }
+        .file-info {
+            background-color: #f8f9fa;
+            border: 1px solid #e9ecef;
+            border-radius: 12px;
+            padding: 20px;
+            margin: 20px 0;
+        }
+        .file-icon {
+            font-size: 32px;
+            margin-bottom: 10px;
+        }
+        .message-box {
+            background-color: #e8f4fd;
+            border-left: 4px solid #2196F3;
+            padding: 15px;
+            border-radius: 8px;
+            margin: 20px 0;
+        }
+        .button {
+            display: inline-block;
+            background-color: #8B5CF6;
+            color: white;
+            padding: 14px 40px;
+            text-decoration: none;
+            border-radius: 8px;
+            font-weight: 600;
+            text-align: center;
+            margin: 30px auto;
+            display: block;
+            width: fit-content;
+        }
+        .footer {
+            text-align: center;
+            color: #666;
+            font-size: 12px;
+            margin-top: 40px;
+            padding-top: 20px;
+            border-top: 1px solid #e9ecef;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="card">
+"""
+
+SHARE_FILE_BODY = """            <div class="header">
+                <div class="logo">☁️</div>
+                <h1>SecureShare Pro</h1>
+            </div>
+
+            <p>Hi{% if recipient_name %} {{ recipient_name }}{% endif %},</p>
+
+            <p>{{ sender_name }} has shared a file with you using SecureShare Pro.</p>
+
+            {% if message %}<div class="message-box">
+                <strong>Message from {{ sender_name }}:</strong><br>
+                {{ message }}
+            </div>{% endif %}
+
+            <div class="file-info">
+                <div class="file-icon">📄</div>
+                <h3 style="margin: 0 0 10px 0;">{{ item_name }}</h3>
+                <p style="margin: 5px 0; color: #666;">Size: {{ file_size }}<br>Expires: {{ expires_at }}</p>
+                {% if has_password %}<p style="margin: 5px 0; color: #ff6b6b;">🔒 Password protected</p>{% endif %}
+            </div>
+
+            <a href="{{ download_url }}" class="button">Download File</a>
+
+            <p style="text-align: center; color: #666; font-size: 14px;">
+                Or copy this link:<br>
+                <a href="{{ download_url }}" style="color: #8B5CF6; word-break: break-all;">{{ download_url }}</a>
+            </p>
+
+            <div class="footer">
+                <p>This email was sent by SecureShare Pro on behalf of {{ sender_email or sender_name }}.</p>
+                <p>© 2024 SecureShare Pro. All rights reserved.</p>
+            </div>
+"""
+
+SHARE_COLLECTION_BODY = """            <div class="header">
+                <div class="logo">☁️</div>
+                <h1>SecureShare Pro</h1>
+            </div>
+
+            <p>Hi{% if recipient_name %} {{ recipient_name }}{% endif %},</p>
+
+            <p>{{ sender_name }} has shared a collection with you using SecureShare Pro.</p>
+
+            {% if message %}<div class="message-box">
+                <strong>Message from {{ sender_name }}:</strong><br>
+                {{ message }}
+            </div>{% endif %}
+
+            <div class="file-info">
+                <div class="file-icon">📁</div>
+                <h3 style="margin: 0 0 10px 0;">{{ item_name }}</h3>
+                <p style="margin: 5px 0; color: #666;">{{ file_count }} files • {{ total_size }}</p>
+                {% if has_password %}<p style="margin: 5px 0; color: #ff6b6b;">🔒 Password protected</p>{% endif %}
+            </div>
+
+            <a href="{{ download_url }}" class="button">View Collection</a>
+
+            <p style="text-align: center; color: #666; font-size: 14px;">
+                Or copy this link:<br>
+                <a href="{{ download_url }}" style="color: #8B5CF6; word-break: break-all;">{{ download_url }}</a>
+            </p>
+
+            <div class="footer">
+                <p>This email was sent by SecureShare Pro on behalf of {{ sender_email or sender_name }}.</p>
+                <p>© 2024 SecureShare Pro. All rights reserved.</p>
+            </div>
+"""
+
+HTML_TAIL = """        </div>
+    </div>
+</body>
+</html>"""
+
+# The <head>/CSS and closing tags never change, so they're encoded once and
+# only the small body fragment is rendered per email
+VERIFY_HEAD_BYTES = VERIFY_HEAD.encode()
+RESET_HEAD_BYTES = RESET_HEAD.encode()
+SHARE_HEAD_BYTES = SHARE_HEAD.encode()
+HTML_TAIL_BYTES = HTML_TAIL.encode()
+
+
+def _make_bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    """
+    On-disk template bytecode cache, so new workers skip parsing. Jinja loads
+    marshalled code from it, so the directory must be private to this user.
+    """
+    try:
+        if not settings.JINJA_BYTECODE_DIR:
+            # Jinja's per-user directory, created 0700 and ownership-checked
+            return FileSystemBytecodeCache(pattern='%s.cache')
+        
+        directory = settings.JINJA_BYTECODE_DIR
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.lstat(directory)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise RuntimeError(f"{directory} must be a directory owned by this user with mode 0700")
+        return FileSystemBytecodeCache(directory=directory, pattern='%s.cache')
+    except (OSError, RuntimeError) as e:
+        logger.warning(f"Template bytecode cache disabled: {e}")
+        return None
+
+# Templates are compiled once per process and rendered per email
+_env = Environment(
+    loader=DictLoader({
+        "verify": VERIFY_BODY,
+        "reset": RESET_BODY,
+        "share_file": SHARE_FILE_BODY,
+        "share_collection": SHARE_COLLECTION_BODY
+    }),
+    autoescape=True,
+    keep_trailing_newline=True,
+    cache_size=400,
+    auto_reload=False
+)
+
+_TEMPLATE_NAMES = ("verify", "reset", "share_file", "share_collection")
+
+
+@functools.cache
+def _template(name: str) -> Template:
+    """Resolve a template once so each send skips the loader lookup; the first
+    call sets up the bytecode cache, so nothing touches the disk at import"""
+    if _env.bytecode_cache is None:
+        _env.bytecode_cache = _make_bytecode_cache()
+    return _env.get_template(name)
+
+_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+
+def format_bytes(bytes_size: int) -> str:
+    """Format file size for display"""
+    # bit_length picks the 1024-power directly instead of dividing unit by unit
+    idx = min((int(bytes_size).bit_length() - 1) // 10, 5) if bytes_size >= 1 else 0
+    return f"{bytes_size / (1 << (idx * 10)):.1f} {_UNITS[idx]}"
+
+
 class EmailService:
     """Email service for sending verification and notification emails"""
     
@@ -17,15 +454,72 @@ class EmailService:
         """Generate a secure random verification token"""
         return secrets.token_urlsafe(32)
     
+    @staticmethod
+    def generate_reset_code() -> str:
+        """Generate a 6-digit password reset code"""
+        return f"{secrets.randbelow(1_000_000):06d}"
+    
+    @staticmethod
+    async def warmup():
+        """Pay template and SMTP connection setup costs at startup, not on the first send"""
+        for name in _TEMPLATE_NAMES:
+            _template(name).render()
+        
+        try:
+            if async_smtp is not None:
+                await async_smtp.warm(settings.SMTP_POOL_MIN)
+            elif smtp_pool is not None:
+                await asyncio.to_thread(smtp_pool.warm, settings.SMTP_POOL_MIN)
+        except Exception as e:
+            # The first send will retry the connection
+            logger.warning(f"SMTP warmup failed: {e}")
+    
+    @staticmethod
+    async def shutdown():
+        """Close SMTP connections"""
+        if async_smtp is not None:
+            await async_smtp.close()
+        elif smtp_pool is not None:
+            await asyncio.to_thread(smtp_pool.close_all)
+    
+    @staticmethod
+    def _build_message(to: str, subject: str, html_body: bytes, text_body: str) -> EmailMessage:
+        """Build a text + HTML email; html_body is already UTF-8 encoded"""
+        msg = EmailMessage()
+        msg["Subject"] = subject
+        msg["From"] = settings.SMTP_FROM
+        msg["To"] = to
+        msg.set_content(text_body)
+        msg.add_alternative(
+            html_body, maintype="text", subtype="html", cte="base64", params={"charset": "utf-8"}
+        )
+        return msg
+    
+    @staticmethod
+    async def _deliver(to: str, subject: str, html_body: bytes, text_body: str):
+        """Send an email over the persistent SMTP connection"""
+        if async_smtp is None and smtp_pool is None:
+            logger.warning(f"SMTP not configured, email to {to} not sent")
+            return
+        
+        msg = EmailService._build_message(to, subject, html_body, text_body)
+        
+        if async_smtp is not None:
+            await async_smtp.send_message(msg)
+        else:
+            # smtplib is blocking; keep it off the event loop
+            await asyncio.to_thread(smtp_pool.send_message, msg)
+    
     @staticmethod
     async def send_verification_email(email: str, token: str, base_url: str) -> bool:
         """Send verification email to user"""
         
         # For development, just log the verification link
         if settings.ENVIRONMENT == "development":
-            verification_link = f"{base_url}/verify-email?token={token}"
-            logger.info(f"Email verification link for {email}: {verification_link}")
-            print(f"\n📧 Email Verification Link (dev mode):\n{verification_link}\n")
+            logger.info(
+                "Email verification link (dev mode) for %s: %s/verify-email?token=%s",
+                email, base_url, token
+            )
             return True
         
         # Production email sending would go here
@@ -39,114 +533,18 @@ class EmailService:
             # Example with SMTP (you'd configure with your email service)
             subject = "Verify your SecureShare Pro account"
             
-            html_body = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <style>
-                    body {{
-                        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                        background-color: #0f0f0f;
-                        color: #e0e0e0;
-                        margin: 0;
-                        padding: 0;
-                    }}
-                    .container {{
-                        max-width: 600px;
-                        margin: 0 auto;
-                        padding: 40px 20px;
-                    }}
-                    .card {{
-                        background: linear-gradient(135deg, #1a1a1a 0%, #2d2d2d 100%);
-                        border-radius: 16px;
-                        padding: 40px;
-                        box-shadow: 0 10px 30px rgba(0,0,0,0.5);
-                        border: 1px solid #333;
-                    }}
-                    .logo {{
-                        text-align: center;
-                        margin-bottom: 30px;
-                    }}
-                    h1 {{
-                        background: linear-gradient(135deg, #3b82f6 0%, #8b5cf6 100%);
-                        -webkit-background-clip: text;
-                        -webkit-text-fill-color: transparent;
-                        font-size: 28px;
-                        margin: 0 0 20px 0;
-                        text-align: center;
-                    }}
-                    .content {{
-                        line-height: 1.6;
-                        color: #b0b0b0;
-                        margin-bottom: 30px;
-                    }}
-                    .button {{
-                        display: inline-block;
-                        background: linear-gradient(135deg, #3b82f6 0%, #8b5cf6 100%);
-                        color: white;
-                        padding: 14px 32px;
-                        text-decoration: none;
-                        border-radius: 8px;
-                        font-weight: 600;
-                        text-align: center;
-                        margin: 20px auto;
-                        display: block;
-                        width: fit-content;
-                        box-shadow: 0 4px 15px rgba(59, 130, 246, 0.4);
-                        transition: all 0.3s ease;
-                    }}
-                    .footer {{
-                        text-align: center;
-                        color: #666;
-                        font-size: 14px;
-                        margin-top: 40px;
-                    }}
-                    .magic {{
-                        background: linear-gradient(90deg, #3b82f6, #8b5cf6, #ec4899, #3b82f6);
-                        background-size: 300% 100%;
-                        -webkit-background-clip: text;
-                        -webkit-text-fill-color: transparent;
-                        animation: gradient 3s ease infinite;
-                    }}
-                    @keyframes gradient {{
-                        0% {{ background-position: 0% 50%; }}
-                        50% {{ background-position: 100% 50%; }}
-                        100% {{ background-position: 0% 50%; }}
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="card">
-                        <div class="logo">
-                            <div style="font-size: 48px;">☁️</div>
-                        </div>
-                        <h1>Welcome to SecureShare Pro!</h1>
-                        <div class="content">
-                            <p>Hi there! 👋</p>
-                            <p>Thanks for signing up for SecureShare Pro. You're just one click away from unlocking secure, lightning-fast file sharing.</p>
-                            <p>Please verify your email address to get started:</p>
-                        </div>
-                        <a href="{base_url}/verify-email?token={token}" class="button">
-                            ✨ Verify Email Address
-                        </a>
-                        <div class="content">
-                            <p style="font-size: 14px; color: #666;">
-                                This link will expire in 24 hours. If you didn't sign up for SecureShare Pro, you can safely ignore this email.
-                            </p>
-                        </div>
-                        <div class="footer">
-                            <p class="magic">✨ Secure • Fast • Magical ✨</p>
-                            <p style="color: #555;">© 2024 SecureShare Pro. All rights reserved.</p>
-                        </div>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
+            html_body = (
+                VERIFY_HEAD_BYTES
+                + _template("verify").render(token=token, base_url=base_url).encode()
+                + HTML_TAIL_BYTES
+            )
+            text_body = (
+                "Thanks for signing up for SecureShare Pro. Verify your email address to get started:\n\n"
+                f"{base_url}/verify-email?token={token}\n\n"
+                "This link will expire in 24 hours. If you didn't sign up, you can safely ignore this email.\n"
+            )
             
-            # This is where you'd actually send the email
-            # For now, we'll just return True in development
+            await EmailService._deliver(email, subject, html_body, text_body)
             return True
             
         except Exception as e:
@@ -158,121 +556,24 @@ class EmailService:
         """Send password reset email with 6-digit code"""
         
         if settings.ENVIRONMENT == "development":
-            logger.info(f"Password reset code for {email}: {code}")
-            print(f"\n🔐 Password Reset Code (dev mode):")
-            print(f"Email: {email}")
-            print(f"Code: {code}")
-            print(f"Valid for: 15 minutes\n")
+            logger.info("Password reset code (dev mode) for %s: %s (valid for 15 minutes)", email, code)
             return True
         
         try:
             subject = "Reset your SecureShare Pro password"
             
-            html_body = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <style>
-                    body {{
-                        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                        background-color: #0a0a0a;
-                        color: #e0e0e0;
-                        margin: 0;
-                        padding: 0;
-                    }}
-                    .container {{
-                        max-width: 600px;
-                        margin: 0 auto;
-                        padding: 40px 20px;
-                    }}
-                    .card {{
-                        background: linear-gradient(135deg, #1a1a1a 0%, #2d2d2d 100%);
-                        border-radius: 16px;
-                        padding: 40px;
-                        box-shadow: 0 10px 30px rgba(0,0,0,0.5);
-                        border: 1px solid #333;
-                    }}
-                    .logo {{
-                        text-align: center;
-                        margin-bottom: 30px;
-                    }}
-                    h1 {{
-                        background: linear-gradient(135deg, #3b82f6 0%, #8b5cf6 100%);
-                        -webkit-background-clip: text;
-                        -webkit-text-fill-color: transparent;
-                        font-size: 28px;
-                        margin: 0 0 20px 0;
-                        text-align: center;
-                    }}
-                    .code-box {{
-                        background: #0a0a0a;
-                        border: 2px solid #3b82f6;
-                        border-radius: 12px;
-                        padding: 30px;
-                        text-align: center;
-                        margin: 30px 0;
-                    }}
-                    .code {{
-                        font-size: 48px;
-                        font-weight: bold;
-                        letter-spacing: 12px;
-                        color: #3b82f6;
-                        font-family: 'Courier New', monospace;
-                    }}
-                    .content {{
-                        line-height: 1.6;
-                        color: #b0b0b0;
-                        margin-bottom: 20px;
-                    }}
-                    .footer {{
-                        text-align: center;
-                        color: #666;
-                        font-size: 14px;
-                        margin-top: 40px;
-                    }}
-                    .warning {{
-                        background: rgba(239, 68, 68, 0.1);
-                        border: 1px solid rgba(239, 68, 68, 0.3);
-                        border-radius: 8px;
-                        padding: 15px;
-                        margin: 20px 0;
-                        color: #fca5a5;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="card">
-                        <div class="logo">
-                            <div style="font-size: 48px;">🔐</div>
-                        </div>
-                        <h1>Password Reset Request</h1>
-                        <div class="content">
-                            <p>Hi there,</p>
-                            <p>We received a request to reset your SecureShare Pro password. Use the code below to reset your password:</p>
-                        </div>
-                        <div class="code-box">
-                            <div class="code">{code}</div>
-                        </div>
-                        <div class="content">
-                            <p><strong>This code expires in 15 minutes.</strong></p>
-                            <p>Enter this code on the password reset page to create a new password.</p>
-                        </div>
-                        <div class="warning">
-                            <p><strong>⚠️ Security Notice:</strong></p>
-                            <p>If you didn't request this password reset, please ignore this email. Your password will remain unchanged.</p>
-                        </div>
-                        <div class="footer">
-                            <p style="color: #555;">© 2024 SecureShare Pro. All rights reserved.</p>
-                        </div>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
+            html_body = (
+                RESET_HEAD_BYTES
+                + _template("reset").render(code=code).encode()
+                + HTML_TAIL_BYTES
+            )
+            text_body = (
+                f"Your SecureShare Pro password reset code is {code}\n\n"
+                "This code expires in 15 minutes. If you didn't request a password reset, "
+                "ignore this email and your password will remain unchanged.\n"
+            )
             
-            # Here you would send the actual email
-            # For now, return True
+            await EmailService._deliver(email, subject, html_body, text_body)
             return True
             
         except Exception as e:
@@ -285,177 +586,111 @@ class EmailService:
         
         is_collection = kwargs.get('is_collection', False)
         
-        # Format file size
-        def format_bytes(bytes_size):
-            for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-                if bytes_size < 1024.0:
-                    return f"{bytes_size:.1f} {unit}"
-                bytes_size /= 1024.0
-            return f"{bytes_size:.1f} PB"
-        
         if settings.ENVIRONMENT == "development":
             if is_collection:
-                share_link = kwargs['collection_url']
-                logger.info(f"Collection share link for {kwargs['recipient_email']}: {share_link}")
-                print(f"\n📁 Collection Share Link (dev mode):")
-                print(f"To: {kwargs['recipient_email']}")
-                print(f"From: {kwargs['sender_name']} ({kwargs.get('sender_email', 'N/A')})")
-                print(f"Collection: {kwargs['collection_name']} ({kwargs['file_count']} files, {format_bytes(kwargs['total_size'])})")
-                if kwargs.get('message'):
-                    print(f"Message: {kwargs['message']}")
-                print(f"Link: {share_link}\n")
+                logger.info(
+                    "Collection share (dev mode) to %s from %s (%s): %s (%s files, %s) message=%r link=%s",
+                    kwargs['recipient_email'],
+                    kwargs['sender_name'],
+                    kwargs.get('sender_email', 'N/A'),
+                    kwargs['collection_name'],
+                    kwargs['file_count'],
+                    format_bytes(kwargs['total_size']),
+                    kwargs.get('message'),
+                    kwargs['collection_url']
+                )
             else:
-                share_link = kwargs['download_url']
-                logger.info(f"File share link for {kwargs['recipient_email']}: {share_link}")
-                print(f"\n📄 File Share Link (dev mode):")
-                print(f"To: {kwargs['recipient_email']}")
-                print(f"From: {kwargs['sender_name']} ({kwargs.get('sender_email', 'N/A')})")
-                print(f"File: {kwargs['file_name']} ({format_bytes(kwargs['file_size'])})")
-                print(f"Expires: {kwargs['expires_at'].strftime('%B %d, %Y at %I:%M %p')}")
-                if kwargs.get('message'):
-                    print(f"Message: {kwargs['message']}")
-                print(f"Link: {share_link}\n")
+                logger.info(
+                    "File share (dev mode) to %s from %s (%s): %s (%s, expires %s) message=%r link=%s",
+                    kwargs['recipient_email'],
+                    kwargs['sender_name'],
+                    kwargs.get('sender_email', 'N/A'),
+                    kwargs['file_name'],
+                    format_bytes(kwargs['file_size']),
+                    kwargs['expires_at'].strftime('%B %d, %Y at %I:%M %p'),
+                    kwargs.get('message'),
+                    kwargs['download_url']
+                )
             return True
         
         # Production email sending
         try:
-            if is_collection:
-                subject = f"{kwargs['sender_name']} shared a collection with you"
-                item_type = "collection"
-                item_name = kwargs['collection_name']
-                item_details = f"{kwargs['file_count']} files • {format_bytes(kwargs['total_size'])}"
-                download_url = kwargs['collection_url']
-                button_text = "View Collection"
-            else:
-                subject = f"{kwargs['sender_name']} sent you a file"
-                item_type = "file"
-                item_name = kwargs['file_name']
-                item_details = f"Size: {format_bytes(kwargs['file_size'])}<br>Expires: {kwargs['expires_at'].strftime('%B %d, %Y at %I:%M %p')}"
-                download_url = kwargs['download_url']
-                button_text = "Download File"
-            
-            html_body = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <style>
-                    body {{
-                        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                        background-color: #f5f5f5;
-                        color: #333;
-                        margin: 0;
-                        padding: 0;
-                    }}
-                    .container {{
-                        max-width: 600px;
-                        margin: 0 auto;
-                        padding: 40px 20px;
-                    }}
-                    .card {{
-                        background: white;
-                        border-radius: 16px;
-                        padding: 40px;
-                        box-shadow: 0 4px 20px rgba(0,0,0,0.1);
-                    }}
-                    .header {{
-                        text-align: center;
-                        margin-bottom: 30px;
-                    }}
-                    .logo {{
-                        font-size: 48px;
-                        margin-bottom: 10px;
-                    }}
-                    h1 {{
-                        color: #8B5CF6;
-                        font-size: 28px;
-                        margin: 0 0 30px 0;
-                    }}
-                    .file-info {{
-                        background-color: #f8f9fa;
-                        border: 1px solid #e9ecef;
-                        border-radius: 12px;
-                        padding: 20px;
-                        margin: 20px 0;
-                    }}
-                    .file-icon {{
-                        font-size: 32px;
-                        margin-bottom: 10px;
-                    }}
-                    .message-box {{
-                        background-color: #e8f4fd;
-                        border-left: 4px solid #2196F3;
-                        padding: 15px;
-                        border-radius: 8px;
-                        margin: 20px 0;
-                    }}
-                    .button {{
-                        display: inline-block;
-                        background-color: #8B5CF6;
-                        color: white;
-                        padding: 14px 40px;
-                        text-decoration: none;
-                        border-radius: 8px;
-                        font-weight: 600;
-                        text-align: center;
-                        margin: 30px auto;
-                        display: block;
-                        width: fit-content;
-                    }}
-                    .footer {{
-                        text-align: center;
-                        color: #666;
-                        font-size: 12px;
-                        margin-top: 40px;
-                        padding-top: 20px;
-                        border-top: 1px solid #e9ecef;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="card">
-                        <div class="header">
-                            <div class="logo">☁️</div>
-                            <h1>SecureShare Pro</h1>
-                        </div>
-                        
-                        <p>Hi{f" {kwargs['recipient_name']}" if kwargs.get('recipient_name') else ''},</p>
-                        
-                        <p>{kwargs['sender_name']} has shared a {item_type} with you using SecureShare Pro.</p>
-                        
-                        {f'''<div class="message-box">
-                            <strong>Message from {kwargs['sender_name']}:</strong><br>
-                            {kwargs['message']}
-                        </div>''' if kwargs.get('message') else ''}
-                        
-                        <div class="file-info">
-                            <div class="file-icon">{'📁' if is_collection else '📄'}</div>
-                            <h3 style="margin: 0 0 10px 0;">{item_name}</h3>
-                            <p style="margin: 5px 0; color: #666;">{item_details}</p>
-                            {f'<p style="margin: 5px 0; color: #ff6b6b;">🔒 Password protected</p>' if kwargs.get('has_password') else ''}
-                        </div>
-                        
-                        <a href="{download_url}" class="button">{button_text}</a>
-                        
-                        <p style="text-align: center; color: #666; font-size: 14px;">
-                            Or copy this link:<br>
-                            <a href="{download_url}" style="color: #8B5CF6; word-break: break-all;">{download_url}</a>
-                        </p>
-                        
-                        <div class="footer">
-                            <p>This email was sent by SecureShare Pro on behalf of {kwargs.get('sender_email') or kwargs['sender_name']}.</p>
-                            <p>© 2024 SecureShare Pro. All rights reserved.</p>
-                        </div>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
+            subject, html_body, text_body = EmailService._render_share(kwargs)
             
-            # Here you would send the actual email using your email service
-            # For now, return True
+            await EmailService._deliver(kwargs['recipient_email'], subject, html_body, text_body)
             return True
             
         except Exception as e:
             logger.error(f"Failed to send share email: {e}")
-            return False
\ No newline at end of file
+            return False
+    
+    @staticmethod
+    def _render_share(kwargs: dict) -> Tuple[str, bytes, str]:
+        """Build subject, HTML body and text body for a file/collection share email"""
+        common = {
+            "recipient_name": kwargs.get('recipient_name'),
+            "sender_name": kwargs['sender_name'],
+            "sender_email": kwargs.get('sender_email'),
+            "message": kwargs.get('message'),
+            "has_password": kwargs.get('has_password')
+        }
+        
+        # Each share kind has its own template, so the branching happens once here
+        if kwargs.get('is_collection', False):
+            subject = f"{kwargs['sender_name']} shared a collection with you"
+            item_type = "collection"
+            item_name = kwargs['collection_name']
+            download_url = kwargs['collection_url']
+            button_text = "View Collection"
+            body = _template("share_collection").render(
+                item_name=item_name,
+                download_url=download_url,
+                file_count=kwargs['file_count'],
+                total_size=format_bytes(kwargs['total_size']),
+                **common
+            )
+        else:
+            subject = f"{kwargs['sender_name']} sent you a file"
+            item_type = "file"
+            item_name = kwargs['file_name']
+            download_url = kwargs['download_url']
+            button_text = "Download File"
+            body = _template("share_file").render(
+                item_name=item_name,
+                download_url=download_url,
+                file_size=format_bytes(kwargs['file_size']),
+                expires_at=kwargs['expires_at'].strftime('%B %d, %Y at %I:%M %p'),
+                **common
+            )
+        
+        text_body = f"{kwargs['sender_name']} has shared a {item_type} with you: {item_name}\n\n"
+        if kwargs.get('message'):
+            text_body += f"Message from {kwargs['sender_name']}:\n{kwargs['message']}\n\n"
+        text_body += f"{button_text}: {download_url}\n"
+        
+        return subject, SHARE_HEAD_BYTES + body.encode() + HTML_TAIL_BYTES, text_body
+    
+    @staticmethod
+    async def send_share_email_bulk(batch: List[dict]) -> int:
+        """
+        Send many share emails over a single SMTP session.
+        Each item takes the same keyword arguments as send_share_email.
+        Returns the number of emails sent; raises BatchAbort if too many are rejected.
+        """
+        if settings.ENVIRONMENT == "development" or (async_smtp is None and smtp_pool is None):
+            sent = 0
+            for kwargs in batch:
+                if await EmailService.send_share_email(**kwargs):
+                    sent += 1
+            return sent
+        
+        messages = []
+        for kwargs in batch:
+            subject, html_body, text_body = EmailService._render_share(kwargs)
+            messages.append(
+                EmailService._build_message(kwargs['recipient_email'], subject, html_body, text_body)
+            )
+        
+        if async_smtp is not None:
+            return await async_smtp.send_many(messages)
+        return await asyncio.to_thread(smtp_pool.send_many, messages)
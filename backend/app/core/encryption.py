@@ -1,17 +1,124 @@
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cachetools import LRUCache
 import base64
+import hashlib
+import io
+import hmac
+import mmap
 import os
+import struct
+import time
 import asyncio
-from typing import Tuple, Optional
+import logging
+import threading
+from typing import BinaryIO, List, Tuple, Optional
 from app.core.config import settings
 from app.core.key_management import master_key_manager, KeyValidation
 
+logger = logging.getLogger(__name__)
+
+# Encrypted file layout: format byte || 12-byte nonce || AES-GCM ciphertext+tag.
+# Legacy Fernet tokens start with "g" (0x67), so they never collide with a format byte.
+# V1 files use key_management's PBKDF2 file keys; V2 files use local HKDF keys
+# and carry a 2-byte master key version after the format byte.
+AESGCM_V1 = b"\x01"
+AESGCM_V2 = b"\x03"
+NONCE_SIZE = 12
+HKDF_SALT = b"znapfile_file_encryption_v1"
+# Old filenames were base64 of a Fernet token, which itself starts with "gAAAAA"
+LEGACY_FILENAME_PREFIX = "Z0FBQUFB"
+
+# Streamed file layout: format byte || 2-byte key version, then frames of
+# 4-byte big-endian length || nonce || ciphertext || 16-byte tag.
+# Each frame authenticates its index and a final flag, so frames can't be
+# reordered, dropped or truncated without failing decryption.
+AESGCM_STREAM_V1 = b"\x02"
+STREAM_CHUNK_SIZE = 1 << 20  # 1MB frames
+TAG_SIZE = 16
+
+
+def _seal_frame(key: bytes, aad: bytes, index: int, final: bool,
+                chunk: bytes, buf: bytearray) -> List[bytes]:
+    """Encrypt one stream frame into buf; returns the parts to write"""
+    nonce = os.urandom(NONCE_SIZE)
+    encryptor = Cipher(algorithms.AES(key), modes.GCM(nonce)).encryptor()
+    encryptor.authenticate_additional_data(aad + struct.pack(">QB", index, final))
+    size = encryptor.update_into(chunk, buf)
+    encryptor.finalize()
+    return [
+        struct.pack(">I", NONCE_SIZE + size + TAG_SIZE),
+        nonce,
+        memoryview(buf)[:size],
+        encryptor.tag
+    ]
+
+
+def _stream_key_version(header: bytes) -> int:
+    """Parse the stream header, returning its master key version"""
+    if len(header) != 3 or header[:1] != AESGCM_STREAM_V1:
+        raise ValueError("Unsupported encrypted stream format")
+    return struct.unpack_from(">H", header, 1)[0]
+
+
+def _read_frame(header: bytes, read) -> bytes:
+    """Read one length-prefixed frame"""
+    if len(header) != 4:
+        raise ValueError("Truncated encrypted stream")
+    size = struct.unpack(">I", header)[0]
+    frame = read(size)
+    if len(frame) != size:
+        raise ValueError("Truncated encrypted stream")
+    return frame
+
+
+def _open_frame(key: bytes, aad: bytes, index: int, final: bool,
+                frame: bytes, buf: bytearray, write) -> int:
+    """Verify and decrypt one stream frame, passing plaintext to write"""
+    if len(frame) < NONCE_SIZE + TAG_SIZE:
+        raise ValueError("Truncated encrypted stream")
+    nonce, tag = frame[:NONCE_SIZE], frame[-TAG_SIZE:]
+    decryptor = Cipher(algorithms.AES(key), modes.GCM(nonce, tag)).decryptor()
+    decryptor.authenticate_additional_data(aad + struct.pack(">QB", index, final))
+    size = decryptor.update_into(memoryview(frame)[NONCE_SIZE:-TAG_SIZE], buf)
+    # Raises InvalidTag before any unauthenticated plaintext is written
+    decryptor.finalize()
+    write(bytes(buf[:size]))
+    return size
+
+
+class _CipherCache(LRUCache):
+    """LRUCache that logs when it evicts more than 10% of its size per minute"""
+    
+    def __init__(self, maxsize: int, name: str):
+        super().__init__(maxsize)
+        self.name = name
+        self._evictions = 0
+        self._window_start = time.monotonic()
+    
+    def popitem(self):
+        item = super().popitem()
+        self._evictions += 1
+        now = time.monotonic()
+        if now - self._window_start >= 60:
+            if self._evictions * 10 > self.maxsize:
+                logger.info(
+                    f"{self.name} evicted {self._evictions} entries in the last minute "
+                    f"(maxsize {self.maxsize}); consider raising FILE_CIPHER_CACHE"
+                )
+            self._evictions = 0
+            self._window_start = now
+        return item
+
+
 class FileEncryption:
     """
-    Handles file encryption/decryption using Fernet (AES-128 in CBC mode).
+    Handles file encryption/decryption using AES-256-GCM.
     Each file gets a unique encryption key derived from a master key and file ID.
+    Files written with the previous Fernet (AES-128-CBC) format still decrypt.
     Uses secure key management system with key rotation support.
     """
     
@@ -19,73 +126,295 @@ class FileEncryption:
         # Verify master key is configured
         if not hasattr(settings, 'ENCRYPTION_MASTER_KEY') or not settings.ENCRYPTION_MASTER_KEY:
             raise ValueError("ENCRYPTION_MASTER_KEY not configured")
-        # Key management is handled by master_key_manager
-        self._key_cache = {}
+        # Current master key and version; re-resolved through KeyRotation's
+        # version cache so rotations (here or in another worker) are picked up
+        self._master_key: Optional[bytes] = None
+        self._key_version: Optional[int] = None
+        # key_version -> HMAC keyed with that version's HKDF PRK
+        self._expanders = {}
+        # (key_version, file_id) -> (key, AESGCM)
+        self._cipher_cache = _CipherCache(settings.FILE_CIPHER_CACHE, "File cipher cache")
+        # file_id -> (AESGCM, Fernet) for files written before HKDF keys
+        self._legacy_cache = _CipherCache(settings.FILE_CIPHER_CACHE, "Legacy file cipher cache")
+        # Sync callers run in worker threads, and LRU reads reorder the cache
+        self._cache_lock = threading.Lock()
+        # Event loop that owns master_key_manager's connections
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
     
-    def generate_file_key(self, file_id: str) -> bytes:
-        """Generate a unique encryption key for each file using secure key management"""
-        # Check cache first
-        if file_id in self._key_cache:
-            return self._key_cache[file_id]
-        
-        # Get key from secure key management
-        # Handle async in sync context
+    async def load_master_key(self):
+        """Fetch the current encryption master key and validate it (call on startup)"""
+        await self.current_key_version()
+        self.startup_selfcheck()
+    
+    async def current_key_version(self) -> int:
+        """Current encryption key version; reloads the master key when it has changed"""
+        self._loop = asyncio.get_running_loop()
+        version = await master_key_manager.key_rotation.get_current_key_version("encryption")
+        if version != self._key_version:
+            self._use_version(version)
+        return version
+    
+    def _current_key_version_sync(self) -> int:
+        """current_key_version for sync callers; only goes to Redis when the cached version is stale"""
+        version = master_key_manager.key_rotation.cached_key_version("encryption")
+        if version is None:
+            return self._run_sync(self.current_key_version())
+        if version != self._key_version:
+            self._use_version(version)
+        return version
+    
+    def _use_version(self, version: int):
+        """Make version the current master key version"""
+        master_key = master_key_manager.get_master_key("encryption", version)
+        self._master_key, self._key_version = master_key, version
+    
+    def startup_selfcheck(self):
+        """Validate the master key and a derived test key once, instead of every file key"""
+        for key in (self._master_key, self._derive("selfcheck", self._key_version)):
+            is_valid, error = KeyValidation.validate_key_strength(key)
+            if not is_valid:
+                raise ValueError(f"Encryption key validation failed: {error}")
+    
+    def _run_sync(self, coro):
+        """Run a key management coroutine from synchronous code"""
         try:
-            loop = asyncio.get_event_loop()
+            asyncio.get_running_loop()
         except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        key = loop.run_until_complete(
-            master_key_manager.get_file_encryption_key(file_id)
-        )
-        
-        # Validate key strength
-        is_valid, error = KeyValidation.validate_key_strength(key)
-        if not is_valid:
-            raise ValueError(f"Generated key validation failed: {error}")
-        
-        # Convert to Fernet-compatible format
-        fernet_key = base64.urlsafe_b64encode(key[:32])  # Fernet needs exactly 32 bytes
+            pass
+        else:
+            # Blocking here would deadlock the event loop
+            coro.close()
+            raise RuntimeError("Encryption keys not loaded; await get_cipher() from async code")
         
-        # Cache for performance
-        self._key_cache[file_id] = fernet_key
+        if self._loop is not None and self._loop.is_running():
+            # Called from a worker thread: hand the lookup to the app's loop
+            return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+        return asyncio.run(coro)
+    
+    def _expander(self, version: int):
+        """HMAC keyed with the HKDF-Extract PRK for a master key version"""
+        expander = self._expanders.get(version)
+        if expander is None:
+            master_key = master_key_manager.get_master_key("encryption", version)
+            prk = hmac.new(HKDF_SALT, master_key, hashlib.sha256).digest()
+            expander = self._expanders[version] = hmac.new(prk, digestmod=hashlib.sha256)
+        return expander
+    
+    def derive_many(self, file_ids: List[str], version: Optional[int] = None) -> List[bytes]:
+        """
+        HKDF-SHA256 keys for many files at once. A 32-byte key is a single
+        HKDF-Expand block, so each key is one copy of a pre-keyed HMAC.
+        """
+        if version is None:
+            version = self._current_key_version_sync()
         
-        return fernet_key
+        expander = self._expander(version)
+        prefix = f"{version}:".encode()
+        keys = []
+        for file_id in file_ids:
+            h = expander.copy()
+            h.update(prefix + file_id.encode() + b"\x01")
+            keys.append(h.digest())
+        return keys
+    
+    def _derive(self, file_id: str, version: int) -> bytes:
+        """HKDF-derive a file key; pure CPU, no key management round-trip"""
+        key = self.derive_many([file_id], version)[0]
+        # HKDF output is uniform, so this only guards against bugs
+        assert KeyValidation.validate_key_strength(key)[0]
+        return key
+    
+    def generate_file_key(self, file_id: str) -> bytes:
+        """Generate a unique encryption key for each file from the current master key"""
+        return self._derive(file_id, self._current_key_version_sync())
+    
+    def _get_cipher(self, file_id: str, version: int) -> Tuple[bytes, AESGCM]:
+        """Get the (cached) raw key and AES-GCM cipher for a file under a key version"""
+        with self._cache_lock:
+            cached = self._cipher_cache.get((version, file_id))
+        if cached is None:
+            key = self._derive(file_id, version)
+            cached = (key, AESGCM(key))
+            # Cache for performance
+            with self._cache_lock:
+                self._cipher_cache[(version, file_id)] = cached
+        return cached
+    
+    async def prime_ciphers(self, file_ids: List[str]):
+        """Derive and cache current-version ciphers for a batch of files"""
+        version = await self.current_key_version()
+        with self._cache_lock:
+            missing = [f for f in file_ids if (version, f) not in self._cipher_cache]
+        entries = [(key, AESGCM(key)) for key in self.derive_many(missing, version)]
+        with self._cache_lock:
+            for file_id, entry in zip(missing, entries):
+                self._cipher_cache[(version, file_id)] = entry
+    
+    async def get_cipher(self, file_id: str) -> Tuple[bytes, AESGCM]:
+        """Get the (cached) raw key and AES-GCM cipher for a file under the current version"""
+        return self._get_cipher(file_id, await self.current_key_version())
+    
+    def _cache_legacy(self, file_id: str, key: bytes) -> Tuple[AESGCM, Fernet]:
+        """Cache the ciphers for a key_management file key"""
+        # PBKDF2 output is uniform; startup_selfcheck covers the master key
+        assert KeyValidation.validate_key_strength(key)[0]
+        key = key[:32]  # 256-bit key
+        cached = (AESGCM(key), Fernet(base64.urlsafe_b64encode(key)))
+        with self._cache_lock:
+            self._legacy_cache[file_id] = cached
+        return cached
+    
+    async def get_legacy_cipher(self, file_id: str) -> Tuple[AESGCM, Fernet]:
+        """Get the (cached) ciphers for files written with PBKDF2 file keys"""
+        with self._cache_lock:
+            cached = self._legacy_cache.get(file_id)
+        if cached is None:
+            self._loop = asyncio.get_running_loop()
+            key = await master_key_manager.get_file_encryption_key(file_id)
+            cached = self._cache_legacy(file_id, key)
+        return cached
+    
+    def _get_legacy(self, file_id: str) -> Tuple[AESGCM, Fernet]:
+        """Sync counterpart of get_legacy_cipher"""
+        with self._cache_lock:
+            cached = self._legacy_cache.get(file_id)
+        if cached is None:
+            key = self._run_sync(master_key_manager.get_file_encryption_key(file_id))
+            cached = self._cache_legacy(file_id, key)
+        return cached
     
     def encrypt_file(self, file_data: bytes, file_id: str) -> bytes:
         """Encrypt file data"""
-        key = self.generate_file_key(file_id)
-        f = Fernet(key)
-        encrypted_data = f.encrypt(file_data)
-        return encrypted_data
+        return self._encrypt(file_data, file_id, self._current_key_version_sync())
+    
+    def _encrypt(self, file_data: bytes, file_id: str, version: int) -> bytes:
+        """Encrypt file data under a resolved key version (the header records the same one)"""
+        _, aesgcm = self._get_cipher(file_id, version)
+        nonce = os.urandom(NONCE_SIZE)
+        header = AESGCM_V2 + struct.pack(">H", version) + nonce
+        return header + aesgcm.encrypt(nonce, file_data, file_id.encode())
     
     def decrypt_file(self, encrypted_data: bytes, file_id: str) -> bytes:
         """Decrypt file data"""
-        key = self.generate_file_key(file_id)
-        f = Fernet(key)
-        decrypted_data = f.decrypt(encrypted_data)
-        return decrypted_data
+        fmt = encrypted_data[:1]
+        if fmt == AESGCM_STREAM_V1:
+            # Large uploads are stored framed (see encrypt_path)
+            plaintext = io.BytesIO()
+            self.decrypt_stream(io.BytesIO(encrypted_data), plaintext, file_id)
+            return plaintext.getvalue()
+        
+        if fmt == AESGCM_V2:
+            version = struct.unpack_from(">H", encrypted_data, 1)[0]
+            _, aesgcm = self._get_cipher(file_id, version)
+            nonce = encrypted_data[3:3 + NONCE_SIZE]
+            return aesgcm.decrypt(nonce, encrypted_data[3 + NONCE_SIZE:], file_id.encode())
+        
+        aesgcm, fernet = self._get_legacy(file_id)
+        if fmt != AESGCM_V1:
+            return fernet.decrypt(encrypted_data)
+        
+        nonce = encrypted_data[1:1 + NONCE_SIZE]
+        return aesgcm.decrypt(nonce, encrypted_data[1 + NONCE_SIZE:], file_id.encode())
+    
+    async def encrypt_file_async(self, file_data: bytes, file_id: str) -> bytes:
+        """encrypt_file for async callers; never blocks the event loop on key lookup"""
+        return self._encrypt(file_data, file_id, await self.current_key_version())
+    
+    async def decrypt_file_async(self, encrypted_data: bytes, file_id: str) -> bytes:
+        """decrypt_file for async callers; never blocks the event loop on key lookup"""
+        # Versioned formats derive their key locally; only legacy keys need key management
+        if encrypted_data[:1] not in (AESGCM_V2, AESGCM_STREAM_V1):
+            await self.get_legacy_cipher(file_id)
+        return self.decrypt_file(encrypted_data, file_id)
+    
+    def encrypt_path(self, src_path: str, writer: BinaryIO, file_id: str,
+                     chunk_size: int = STREAM_CHUNK_SIZE, version: Optional[int] = None) -> int:
+        """
+        Encrypt a file on disk into framed AES-GCM chunks (AESGCM_STREAM_V1).
+        Frames are sealed straight from an mmap of the source, so memory use is
+        bounded by chunk_size. Returns plaintext bytes written.
+        """
+        if version is None:
+            version = self._current_key_version_sync()
+        key, _ = self._get_cipher(file_id, version)
+        buf = bytearray(chunk_size + 15)
+        aad = file_id.encode()
+        
+        writer.write(AESGCM_STREAM_V1 + struct.pack(">H", version))
+        with open(src_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                for part in _seal_frame(key, aad, 0, True, b"", buf):
+                    writer.write(part)
+                return 0
+            
+            last = (size - 1) // chunk_size
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for index, offset in enumerate(range(0, size, chunk_size)):
+                        chunk = view[offset:offset + chunk_size]
+                        for part in _seal_frame(key, aad, index, index == last, chunk, buf):
+                            writer.write(part)
+                        chunk.release()
+                finally:
+                    view.release()
+        return size
+    
+    async def encrypt_path_async(self, src_path: str, dest_path: str, file_id: str) -> int:
+        """encrypt_path into dest_path for async callers; the sealing runs in a worker thread"""
+        version = await self.current_key_version()
+        
+        def run() -> int:
+            with open(dest_path, 'wb') as writer:
+                return self.encrypt_path(src_path, writer, file_id, version=version)
+        
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+    
+    def decrypt_stream(self, reader: BinaryIO, writer: BinaryIO, file_id: str,
+                       chunk_size: int = STREAM_CHUNK_SIZE) -> int:
+        """Decrypt output of encrypt_path. Returns plaintext bytes written."""
+        key, _ = self._get_cipher(file_id, _stream_key_version(reader.read(3)))
+        buf = bytearray(chunk_size + 15)
+        aad = file_id.encode()
+        
+        total, index = 0, 0
+        header = reader.read(4)
+        while True:
+            frame = _read_frame(header, reader.read)
+            header = reader.read(4)
+            total += _open_frame(key, aad, index, not header, frame, buf, writer.write)
+            if not header:
+                return total
+            index += 1
     
     def encrypt_filename(self, filename: str, file_id: str) -> str:
         """Encrypt filename for additional privacy"""
-        key = self.generate_file_key(file_id)
-        f = Fernet(key)
-        encrypted = f.encrypt(filename.encode())
-        # Return base64 encoded string safe for filenames
-        return base64.urlsafe_b64encode(encrypted).decode()
+        version = self._current_key_version_sync()
+        _, aesgcm = self._get_cipher(file_id, version)
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = aesgcm.encrypt(nonce, filename.encode(), file_id.encode() + b":filename")
+        # One base64 pass over the V2 layout keeps the result filename-safe
+        header = AESGCM_V2 + struct.pack(">H", version) + nonce
+        return base64.urlsafe_b64encode(header + ciphertext).decode()
     
     def decrypt_filename(self, encrypted_filename: str, file_id: str) -> str:
         """Decrypt filename"""
-        key = self.generate_file_key(file_id)
-        f = Fernet(key)
-        encrypted_bytes = base64.urlsafe_b64decode(encrypted_filename.encode())
-        decrypted = f.decrypt(encrypted_bytes)
-        return decrypted.decode()
+        if encrypted_filename.startswith(LEGACY_FILENAME_PREFIX):
+            _, f = self._get_legacy(file_id)
+            return f.decrypt(base64.urlsafe_b64decode(encrypted_filename.encode())).decode()
+        
+        data = base64.urlsafe_b64decode(encrypted_filename.encode())
+        if data[:1] != AESGCM_V2:
+            raise ValueError("Unsupported encrypted filename format")
+        version = struct.unpack_from(">H", data, 1)[0]
+        _, aesgcm = self._get_cipher(file_id, version)
+        nonce = data[3:3 + NONCE_SIZE]
+        return aesgcm.decrypt(nonce, data[3 + NONCE_SIZE:], file_id.encode() + b":filename").decode()
 
 # Singleton instance
 try:
     file_encryption = FileEncryption() if hasattr(settings, 'ENCRYPTION_MASTER_KEY') and settings.ENCRYPTION_MASTER_KEY else None
 except Exception as e:
     print(f"Warning: File encryption disabled: {e}")
-    file_encryption = None
\ No newline at end of file
+    file_encryption = None
@@ -5,27 +5,67 @@ Implements key derivation, rotation, and secure storage
 
 import os
 import json
+import base64
+import functools
 import hashlib
 import hmac
 import time
+import asyncio
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Optional, Tuple, List
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
-from cryptography.fernet import Fernet
 import redis.asyncio as redis
 from app.core.config import settings
 
+# Derived file keys kept per process (each costs a 100k-round PBKDF2 to recompute)
+FILE_KEY_CACHE_SIZE = 8192
+# Seconds a key version read from Redis is trusted before re-reading
+VERSION_CACHE_TTL = 30
+# AES-GCM nonce length for keys held by SecureKeyStorage
+STORAGE_NONCE_SIZE = 12
+
+
+def _hkdf(master_key: bytes, salt: bytes) -> bytes:
+    """Single HKDF-SHA256 expansion used by KeyDerivation.derive_key"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,  # 256-bit key
+        salt=salt,
+        info=b"znapfile-v1",
+        backend=default_backend()
+    ).derive(master_key)
+
+
+@functools.cache
+def _token_salt(token_type: str) -> bytes:
+    """derive_key's salt for (f"token_{token_type}", "signing"); a handful of fixed values"""
+    return hashlib.sha256(f"token_{token_type}:signing".encode()).digest()
+
 
 class KeyDerivation:
-    """Secure key derivation using PBKDF2"""
+    """Key derivation: HKDF for new keys, PBKDF2 kept for keys that already protect data"""
     
     @staticmethod
     def derive_key(master_key: bytes, context: str, key_id: str) -> bytes:
         """
         Derive a unique key for a specific context
-        Uses PBKDF2 with context-specific salt
+        master_key is already high-entropy, so a single HKDF-SHA256 is enough
+        """
+        # Create context-specific salt
+        salt = hashlib.sha256(b":".join((context.encode(), key_id.encode()))).digest()
+        
+        return _hkdf(master_key, salt)
+    
+    @staticmethod
+    def derive_legacy_key(master_key: bytes, context: str, key_id: str) -> bytes:
+        """
+        Original PBKDF2 derivation. Versioned master keys and pre-HKDF file keys
+        were derived this way, so it must stay for existing data to decrypt.
         """
         # Create context-specific salt
         salt = hashlib.sha256(f"{context}:{key_id}".encode()).digest()
@@ -43,55 +83,95 @@ class KeyDerivation:
     
     @staticmethod
     def generate_file_key(master_key: bytes, file_id: str) -> bytes:
-        """Generate unique encryption key for a file"""
-        return KeyDerivation.derive_key(master_key, "file_encryption", file_id)
+        """Generate the key for a file written before HKDF file keys"""
+        return KeyDerivation.derive_legacy_key(master_key, "file_encryption", file_id)
     
     @staticmethod
     def generate_token_key(master_key: bytes, token_type: str) -> bytes:
         """Generate key for token signing"""
-        return KeyDerivation.derive_key(master_key, f"token_{token_type}", "signing")
+        return _hkdf(master_key, _token_salt(token_type))
 
 
 class KeyRotation:
     """Handle key rotation and versioning"""
     
+    __slots__ = (
+        'redis_client', 'key_prefix', 'rotation_log_prefix', '_version_cache', '_inflight', '_connect_lock'
+    )
+    
     def __init__(self):
         self.redis_client = None
         self.key_prefix = "key_version:"
         self.rotation_log_prefix = "key_rotation:"
+        # key_type -> (version, fetched_at); rotations are rare, so a short TTL is safe
+        self._version_cache: Dict[str, Tuple[int, float]] = {}
+        # key_type -> pending version fetch shared by concurrent cache misses
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Serializes the first connect so concurrent callers share one pool
+        self._connect_lock = asyncio.Lock()
     
     async def connect(self):
-        """Initialize Redis connection for key metadata"""
-        if not self.redis_client:
+        """Initialize Redis connection for key metadata (callers check redis_client first)"""
+        async with self._connect_lock:
+            if self.redis_client is not None:
+                return
             try:
-                self.redis_client = await redis.from_url(
+                client = await redis.from_url(
                     settings.REDIS_URL,
                     encoding="utf-8",
-                    decode_responses=True
+                    decode_responses=True,
+                    max_connections=32,
+                    health_check_interval=30
                 )
                 # Test connection
-                await self.redis_client.ping()
+                await client.ping()
+                self.redis_client = client
             except Exception as e:
                 print(f"Warning: Could not connect to Redis for key management: {e}")
                 self.redis_client = None
     
     async def get_current_key_version(self, key_type: str) -> int:
         """Get current key version for a key type"""
-        await self.connect()
+        cached = self._version_cache.get(key_type)
+        if cached and time.monotonic() - cached[1] < VERSION_CACHE_TTL:
+            return cached[0]
+        
+        # Coalesce concurrent misses into one Redis read; shield so a cancelled
+        # caller doesn't cancel the fetch the others are waiting on
+        task = self._inflight.get(key_type)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_key_version(key_type))
+            self._inflight[key_type] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key_type, None))
+        return await asyncio.shield(task)
+    
+    def cached_key_version(self, key_type: str) -> Optional[int]:
+        """The cached current version if it is still fresh, else None (sync, no I/O)"""
+        cached = self._version_cache.get(key_type)
+        if cached and time.monotonic() - cached[1] < VERSION_CACHE_TTL:
+            return cached[0]
+        return None
+    
+    async def _fetch_key_version(self, key_type: str) -> int:
+        """Read the current version from Redis and cache it"""
+        now = time.monotonic()
+        if self.redis_client is None:
+            await self.connect()
         
         if not self.redis_client:
             # Redis not available, always return version 1
-            return 1
-            
-        version = await self.redis_client.get(f"{self.key_prefix}{key_type}")
-        return int(version) if version else 1
+            version = 1
+        else:
+            stored = await self.redis_client.get(f"{self.key_prefix}{key_type}")
+            version = int(stored) if stored else 1
+        
+        self._version_cache[key_type] = (version, now)
+        return version
     
     async def rotate_key(self, key_type: str, new_version: int):
         """Record key rotation"""
-        await self.connect()
-        
-        # Update version
-        await self.redis_client.set(f"{self.key_prefix}{key_type}", new_version)
+        if self.redis_client is None:
+            await self.connect()
         
         # Log rotation
         rotation_info = {
@@ -101,21 +181,27 @@ class KeyRotation:
             "rotated_by": "system"
         }
         
-        await self.redis_client.lpush(
-            f"{self.rotation_log_prefix}{key_type}",
-            json.dumps(rotation_info)
-        )
+        # Update version, log rotation and keep only last 100 rotation logs
+        # atomically in one round-trip
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.set(f"{self.key_prefix}{key_type}", new_version)
+            pipe.lpush(
+                f"{self.rotation_log_prefix}{key_type}",
+                json.dumps(rotation_info)
+            )
+            pipe.ltrim(
+                f"{self.rotation_log_prefix}{key_type}",
+                0,
+                99
+            )
+            await pipe.execute()
         
-        # Keep only last 100 rotation logs
-        await self.redis_client.ltrim(
-            f"{self.rotation_log_prefix}{key_type}",
-            0,
-            99
-        )
+        self._version_cache.pop(key_type, None)
     
     async def get_key_rotation_history(self, key_type: str) -> List[Dict]:
         """Get key rotation history"""
-        await self.connect()
+        if self.redis_client is None:
+            await self.connect()
         
         logs = await self.redis_client.lrange(
             f"{self.rotation_log_prefix}{key_type}",
@@ -126,48 +212,76 @@ class KeyRotation:
         return [json.loads(log) for log in logs]
 
 
+@functools.cache
+def _derive_storage_key() -> bytes:
+    """Derive key for encrypting stored keys (100k PBKDF2 rounds, so once per process)"""
+    # Use multiple sources of entropy
+    entropy_sources = [
+        os.environ.get('HOSTNAME', 'default'),
+        os.environ.get('USER', 'default'),
+        settings.DATABASE_URL,
+        settings.JWT_SECRET[:32]  # Use part of JWT secret
+    ]
+    
+    combined_entropy = '|'.join(entropy_sources).encode()
+    
+    # Derive storage key
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=b'znapfile_key_storage_v1',
+        iterations=100000,
+        backend=default_backend()
+    )
+    
+    return base64.urlsafe_b64encode(kdf.derive(combined_entropy))
+
+
+# Env setting holding the base key for each master key type (others share JWT_SECRET)
+_MASTER_KEY_SETTINGS = {
+    "encryption": "ENCRYPTION_MASTER_KEY",
+    "jwt": "JWT_SECRET",
+}
+
+
+@functools.cache
+def _get_master_key_from_env(key_name: str) -> bytes:
+    """Get master key from environment with validation (resolved once per process)"""
+    key_value = getattr(settings, key_name, None)
+    
+    if not key_value:
+        raise ValueError(f"Master key {key_name} not configured")
+    
+    if len(key_value) < 32:
+        raise ValueError(f"Master key {key_name} too short (min 32 chars)")
+    
+    # Use first 32 bytes if key is longer
+    return key_value.encode()[:32]
+
+
 class SecureKeyStorage:
     """
     Secure storage for encryption keys
     Keys are never stored in plaintext
     """
     
+    __slots__ = ('storage_key', 'aead')
+    
     def __init__(self):
         # Derive storage key from environment entropy
-        self.storage_key = self._derive_storage_key()
-        self.fernet = Fernet(self.storage_key)
-    
-    def _derive_storage_key(self) -> bytes:
-        """Derive key for encrypting stored keys"""
-        # Use multiple sources of entropy
-        entropy_sources = [
-            os.environ.get('HOSTNAME', 'default'),
-            os.environ.get('USER', 'default'),
-            settings.DATABASE_URL,
-            settings.JWT_SECRET[:32]  # Use part of JWT secret
-        ]
-        
-        combined_entropy = '|'.join(entropy_sources).encode()
-        
-        # Derive storage key
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=b'znapfile_key_storage_v1',
-            iterations=100000,
-            backend=default_backend()
-        )
-        
-        key = kdf.derive(combined_entropy)
-        return Fernet.generate_key()  # For Fernet compatibility
+        self.storage_key = _derive_storage_key()
+        self.aead = AESGCM(base64.urlsafe_b64decode(self.storage_key))
     
     def encrypt_key(self, key: bytes) -> bytes:
-        """Encrypt a key for storage"""
-        return self.fernet.encrypt(key)
+        """Encrypt a key for storage (nonce || ciphertext || tag)"""
+        nonce = os.urandom(STORAGE_NONCE_SIZE)
+        return nonce + self.aead.encrypt(nonce, key, None)
     
     def decrypt_key(self, encrypted_key: bytes) -> bytes:
         """Decrypt a stored key"""
-        return self.fernet.decrypt(encrypted_key)
+        return self.aead.decrypt(
+            encrypted_key[:STORAGE_NONCE_SIZE], encrypted_key[STORAGE_NONCE_SIZE:], None
+        )
 
 
 class MasterKeyManager:
@@ -176,61 +290,62 @@ class MasterKeyManager:
     Implements key hierarchy and separation of duties
     """
     
+    __slots__ = ('key_storage', 'key_rotation', '_master_keys_cache', '_file_key_cache')
+    
     def __init__(self):
-        self.key_storage = SecureKeyStorage()
+        self.key_storage = secure_key_storage
         self.key_rotation = KeyRotation()
-        self._master_keys_cache = {}
-        
-    def _get_master_key_from_env(self, key_name: str) -> bytes:
-        """Get master key from environment with validation"""
-        key_value = getattr(settings, key_name, None)
-        
-        if not key_value:
-            raise ValueError(f"Master key {key_name} not configured")
-        
-        if len(key_value) < 32:
-            raise ValueError(f"Master key {key_name} too short (min 32 chars)")
-        
-        # Use first 32 bytes if key is longer
-        return key_value.encode()[:32]
+        # (key_type, version) -> derived master key
+        self._master_keys_cache: Dict[Tuple[str, int], bytes] = {}
+        # (version, file_id) -> derived file key, least recently used first
+        self._file_key_cache: "OrderedDict[Tuple[int, str], bytes]" = OrderedDict()
     
-    async def get_current_master_key(self, key_type: str) -> Tuple[bytes, int]:
-        """
-        Get current master key and version
-        Returns: (key, version)
-        """
+    def get_master_key(self, key_type: str, version: int) -> bytes:
+        """Get the master key for a specific version"""
         # Check cache first
-        cache_key = f"{key_type}_v{await self.key_rotation.get_current_key_version(key_type)}"
-        if cache_key in self._master_keys_cache:
-            return self._master_keys_cache[cache_key]
+        cache_key = (key_type, version)
+        cached = self._master_keys_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         # Get base master key
-        if key_type == "encryption":
-            base_key = self._get_master_key_from_env("ENCRYPTION_MASTER_KEY")
-        elif key_type == "jwt":
-            base_key = self._get_master_key_from_env("JWT_SECRET")
-        else:
-            base_key = self._get_master_key_from_env("JWT_SECRET")  # Fallback
-        
-        # Get current version
-        version = await self.key_rotation.get_current_key_version(key_type)
+        base_key = _get_master_key_from_env(_MASTER_KEY_SETTINGS.get(key_type, "JWT_SECRET"))
         
-        # Derive versioned key
-        versioned_key = KeyDerivation.derive_key(
+        # Derive versioned key (PBKDF2, so keys under existing versions don't change)
+        versioned_key = KeyDerivation.derive_legacy_key(
             base_key,
             f"{key_type}_master",
             f"v{version}"
         )
         
         # Cache for performance
-        self._master_keys_cache[cache_key] = (versioned_key, version)
+        self._master_keys_cache[cache_key] = versioned_key
         
-        return versioned_key, version
+        return versioned_key
+    
+    async def get_current_master_key(self, key_type: str) -> Tuple[bytes, int]:
+        """
+        Get current master key and version
+        Returns: (key, version)
+        """
+        version = await self.key_rotation.get_current_key_version(key_type)
+        return self.get_master_key(key_type, version), version
     
     async def get_file_encryption_key(self, file_id: str) -> bytes:
         """Get encryption key for a specific file"""
-        master_key, _ = await self.get_current_master_key("encryption")
-        return KeyDerivation.generate_file_key(master_key, file_id)
+        master_key, version = await self.get_current_master_key("encryption")
+        
+        cache_key = (version, file_id)
+        key = self._file_key_cache.get(cache_key)
+        if key is not None:
+            self._file_key_cache.move_to_end(cache_key)
+            return key
+        
+        key = KeyDerivation.generate_file_key(master_key, file_id)
+        self._file_key_cache[cache_key] = key
+        if len(self._file_key_cache) > FILE_KEY_CACHE_SIZE:
+            self._file_key_cache.popitem(last=False)
+        return key
     
     async def get_jwt_signing_key(self) -> bytes:
         """Get current JWT signing key"""
@@ -249,6 +364,7 @@ class MasterKeyManager:
         
         # Clear cache to force re-derivation
         self._master_keys_cache.clear()
+        self._file_key_cache.clear()
         
         return new_version
 
@@ -287,5 +403,6 @@ class KeyValidation:
         print(f"Key audit: {audit_entry}")
 
 
-# Global instance
+# Global instances
+secure_key_storage = SecureKeyStorage()
 master_key_manager = MasterKeyManager()
\ No newline at end of file
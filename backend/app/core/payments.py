@@ -103,9 +103,11 @@ class PaymentService:
         """Get current subscription status"""
         
         try:
+            # Expand prices up front so reading the plan never triggers another request
             subscriptions = stripe.Subscription.list(
                 customer=stripe_customer_id,
-                limit=1
+                limit=1,
+                expand=['data.items.data.price']
             )
             
             if not subscriptions.data:
@@ -1,8 +1,9 @@
-from typing import Dict, Any
+from types import MappingProxyType
+from typing import Any, Mapping
 from app.models.user import UserTier
 
 # Plan limits in bytes and other constraints
-PLAN_LIMITS: Dict[UserTier, Dict[str, Any]] = {
+_PLAN_LIMITS = {
     UserTier.FREE: {
         "monthly_transfer_bytes": 2 * 1024 * 1024 * 1024,  # 2GB
         "max_file_size_bytes": 1 * 1024 * 1024 * 1024,     # 1GB
@@ -41,14 +42,20 @@ PLAN_LIMITS: Dict[UserTier, Dict[str, Any]] = {
     },
 }
 
-def get_plan_limits(tier: UserTier) -> Dict[str, Any]:
+# Read-only views, so callers can share them without copying
+PLAN_LIMITS: Mapping[UserTier, Mapping[str, Any]] = MappingProxyType({
+    tier: MappingProxyType(limits) for tier, limits in _PLAN_LIMITS.items()
+})
+
+# (divisor, suffix) per 1024-power
+_UNITS = tuple((1 << (10 * i), unit) for i, unit in enumerate(['B', 'KB', 'MB', 'GB', 'TB', 'PB']))
+
+def get_plan_limits(tier: UserTier) -> Mapping[str, Any]:
     """Get the limits for a specific plan tier"""
     return PLAN_LIMITS.get(tier, PLAN_LIMITS[UserTier.FREE])
 
 def format_bytes(bytes_value: int) -> str:
     """Format bytes to human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if bytes_value < 1024.0:
-            return f"{bytes_value:.1f}{unit}"
-        bytes_value /= 1024.0
-    return f"{bytes_value:.1f}PB"
\ No newline at end of file
+    idx = min((int(bytes_value).bit_length() - 1) // 10, 5) if bytes_value >= 1 else 0
+    divisor, unit = _UNITS[idx]
+    return f"{bytes_value / divisor:.1f}{unit}"
\ No newline at end of file
@@ -1,9 +1,41 @@
 """Cryptographic Proof-of-Work CAPTCHA - Unbreakable by bots"""
 import hashlib
+import hmac
 import secrets
 import time
 import json
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
+import redis.asyncio as redis
+from cachetools import TTLCache
+
+
+# All-zero byte prefixes for every whole-byte part of a SHA-256 difficulty
+_ZERO_PREFIXES = tuple(bytes(n) for n in range(33))
+
+
+def _has_leading_zero_nibbles(digest: bytes, count: int) -> bool:
+    """Same as digest.hex().startswith('0' * count), without hex-encoding"""
+    if count > 2 * len(digest):
+        return False
+    full, half = divmod(count, 2)
+    valid = hmac.compare_digest(digest[:full], _ZERO_PREFIXES[full])
+    if half:
+        valid &= digest[full] & 0xF0 == 0
+    return valid
+
+
+def _check_proof(stored, nonce: str) -> bool:
+    """Check a nonce against a stored "nonce_prefix:difficulty" challenge value"""
+    if not stored:
+        return False
+    if isinstance(stored, str):
+        stored = stored.encode()
+    
+    # stored[:split + 1] is already the "nonce_prefix:" the client hashed
+    split = stored.rindex(b':')
+    digest = hashlib.sha256(stored[:split + 1] + nonce.encode()).digest()
+    return _has_leading_zero_nibbles(digest, int(stored[split + 1:]))
+
 
 class ProofOfWorkCaptcha:
     """
@@ -11,75 +43,52 @@ class ProofOfWorkCaptcha:
     This forces attackers to burn CPU cycles, making automation expensive.
     
     Similar to Bitcoin mining but lighter - takes ~2-5 seconds for legitimate users.
+    Challenges live in Redis so every worker can verify them, and expire there.
     """
     
-    def __init__(self, difficulty: int = 4):
+    __slots__ = ('redis', 'difficulty', 'expiry', 'key_prefix')
+    
+    def __init__(self, redis_client: redis.Redis, difficulty: int = 4):
+        self.redis = redis_client
         self.difficulty = difficulty  # Number of leading zeros required
-        self.challenges = {}  # Store active challenges
         self.expiry = 300  # 5 minutes to solve
+        self.key_prefix = "pow:"
         
-    def generate_challenge(self) -> Tuple[str, str]:
+    async def generate_challenge(self) -> Tuple[str, str]:
         """Generate a new proof-of-work challenge"""
         # Create random challenge
         challenge_id = secrets.token_hex(16)
         nonce_prefix = secrets.token_hex(8)
-        timestamp = int(time.time())
         
-        challenge_data = {
-            'nonce_prefix': nonce_prefix,
-            'timestamp': timestamp,
-            'difficulty': self.difficulty
-        }
-        
-        self.challenges[challenge_id] = challenge_data
-        self._cleanup_expired()
-        
-        # Return challenge for client
-        return challenge_id, json.dumps({
-            'challenge_id': challenge_id,
-            'nonce_prefix': nonce_prefix,
-            'difficulty': self.difficulty,
-            'target': '0' * self.difficulty,
-            'message': f'Find a nonce where SHA256({nonce_prefix}:nonce) starts with {self.difficulty} zeros'
-        })
+        await self.redis.set(
+            f"{self.key_prefix}{challenge_id}",
+            f"{nonce_prefix}:{self.difficulty}",
+            ex=self.expiry,
+            nx=True
+        )
+        
+        # Return challenge for client; every field is hex or an int, so nothing needs escaping
+        # and this matches json.dumps of the same dict byte for byte
+        d = self.difficulty
+        return challenge_id, (
+            f'{{"challenge_id": "{challenge_id}", "nonce_prefix": "{nonce_prefix}", '
+            f'"difficulty": {d}, "target": "{"0" * d}", '
+            f'"message": "Find a nonce where SHA256({nonce_prefix}:nonce) starts with {d} zeros"}}'
+        )
     
-    def verify_proof(self, challenge_id: str, nonce: str) -> bool:
-        """Verify the proof-of-work solution"""
-        challenge_data = self.challenges.get(challenge_id)
-        if not challenge_data:
-            return False
-        
-        # Check expiry
-        if time.time() - challenge_data['timestamp'] > self.expiry:
-            del self.challenges[challenge_id]
-            return False
-        
-        # Verify the proof
-        nonce_prefix = challenge_data['nonce_prefix']
-        difficulty = challenge_data['difficulty']
-        
-        # Calculate hash
-        proof = f"{nonce_prefix}:{nonce}"
-        hash_result = hashlib.sha256(proof.encode()).hexdigest()
-        
-        # Check if hash has required leading zeros
-        is_valid = hash_result.startswith('0' * difficulty)
-        
-        # Remove used challenge
-        if is_valid:
-            del self.challenges[challenge_id]
-        
-        return is_valid
+    async def verify_proof(self, challenge_id: str, nonce: str) -> bool:
+        """Verify the proof-of-work solution (each challenge gets one attempt)"""
+        stored = await self.redis.getdel(f"{self.key_prefix}{challenge_id}")
+        return _check_proof(stored, nonce)
     
-    def _cleanup_expired(self):
-        """Remove expired challenges"""
-        current_time = time.time()
-        expired = [
-            cid for cid, data in self.challenges.items()
-            if current_time - data['timestamp'] > self.expiry
-        ]
-        for cid in expired:
-            del self.challenges[cid]
+    async def verify_proof_batch(self, proofs: List[Tuple[str, str]]) -> List[bool]:
+        """Verify many (challenge_id, nonce) pairs with one Redis round-trip; results keep input order"""
+        pipe = self.redis.pipeline(transaction=False)
+        for challenge_id, _ in proofs:
+            pipe.getdel(f"{self.key_prefix}{challenge_id}")
+        stored = await pipe.execute()
+        
+        return [_check_proof(value, nonce) for value, (_, nonce) in zip(stored, proofs)]
 
 
 class AdaptiveProofOfWork:
@@ -88,8 +97,11 @@ class AdaptiveProofOfWork:
     Increases difficulty for suspicious IPs.
     """
     
+    __slots__ = ('ip_history', 'base_difficulty', 'max_difficulty')
+    
     def __init__(self):
-        self.ip_history = {}  # Track IP behavior
+        # Track IP behavior; entries expire 24 hours after the IP was last seen
+        self.ip_history = TTLCache(maxsize=100_000, ttl=86400)
         self.base_difficulty = 4
         self.max_difficulty = 6
         
@@ -107,29 +119,32 @@ class AdaptiveProofOfWork:
     
     def record_attempt(self, ip: str, success: bool):
         """Record attempt result"""
-        if ip not in self.ip_history:
-            self.ip_history[ip] = {'failures': 0, 'last_seen': time.time()}
+        history = self.ip_history.get(ip) or {'failures': 0, 'last_seen': time.time()}
         
         if not success:
-            self.ip_history[ip]['failures'] += 1
+            history['failures'] += 1
         else:
             # Reduce failure count on success (forgiveness)
-            self.ip_history[ip]['failures'] = max(0, self.ip_history[ip]['failures'] - 1)
+            history['failures'] = max(0, history['failures'] - 1)
         
-        self.ip_history[ip]['last_seen'] = time.time()
+        history['last_seen'] = time.time()
         
-        # Cleanup old entries (older than 24 hours)
-        self._cleanup_old_ips()
-    
-    def _cleanup_old_ips(self):
-        """Remove IPs not seen in 24 hours"""
-        current_time = time.time()
-        old_ips = [
-            ip for ip, data in self.ip_history.items()
-            if current_time - data['last_seen'] > 86400
-        ]
-        for ip in old_ips:
-            del self.ip_history[ip]
+        # Re-insert so the 24 hour TTL counts from this attempt
+        self.ip_history[ip] = history
+
+
+def _build_prime_sieve(limit: int) -> bytes:
+    """Sieve of Eratosthenes: byte n is 1 when n is prime"""
+    sieve = bytearray([1]) * (limit + 1)
+    sieve[0] = sieve[1] = 0
+    for n in range(2, int(limit ** 0.5) + 1):
+        if sieve[n]:
+            sieve[n * n::n] = bytes(len(range(n * n, limit + 1, n)))
+    return bytes(sieve)
+
+
+# Puzzles ask about [a, a + 20] with a < 1000
+_PRIME_SIEVE = _build_prime_sieve(1020)
 
 
 # Alternative: Cryptographic puzzle CAPTCHA
@@ -137,12 +152,17 @@ class CryptoPuzzleCaptcha:
     """
     More user-friendly than proof-of-work but still secure.
     Uses cryptographic puzzles that are easy for humans but hard for bots.
+    Answers live in Redis so every worker can verify them, and expire there.
     """
     
-    def __init__(self):
-        self.puzzles = {}
+    __slots__ = ('redis', 'expiry', 'key_prefix')
+    
+    def __init__(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        self.expiry = 300  # 5 minutes to answer
+        self.key_prefix = "puzzle:"
         
-    def generate_puzzle(self) -> Tuple[str, str]:
+    async def generate_puzzle(self) -> Tuple[str, str]:
         """Generate a crypto puzzle"""
         puzzle_id = secrets.token_hex(16)
         
@@ -171,10 +191,12 @@ class CryptoPuzzleCaptcha:
         ]
         
         puzzle = secrets.choice(puzzle_types)
-        self.puzzles[puzzle_id] = {
-            'answer': puzzle['answer'],
-            'created_at': time.time()
-        }
+        await self.redis.set(
+            f"{self.key_prefix}{puzzle_id}",
+            puzzle['answer'],
+            ex=self.expiry,
+            nx=True
+        )
         
         return puzzle_id, json.dumps({
             'puzzle_id': puzzle_id,
@@ -182,23 +204,14 @@ class CryptoPuzzleCaptcha:
             'type': puzzle['type']
         })
     
-    def verify_answer(self, puzzle_id: str, answer: str) -> bool:
-        """Verify puzzle answer"""
-        puzzle_data = self.puzzles.get(puzzle_id)
-        if not puzzle_data:
-            return False
-        
-        # Check expiry (5 minutes)
-        if time.time() - puzzle_data['created_at'] > 300:
-            del self.puzzles[puzzle_id]
+    async def verify_answer(self, puzzle_id: str, answer: str) -> bool:
+        """Verify puzzle answer (each puzzle gets one attempt)"""
+        stored = await self.redis.getdel(f"{self.key_prefix}{puzzle_id}")
+        if not stored:
             return False
-        
-        is_correct = puzzle_data['answer'] == answer.strip()
-        
-        # Remove used puzzle
-        del self.puzzles[puzzle_id]
-        
-        return is_correct
+        if isinstance(stored, str):
+            stored = stored.encode()
+        return hmac.compare_digest(stored, answer.strip().encode())
     
     def _partial_hash(self, seed: int) -> str:
         """Generate partial hash for puzzle"""
@@ -207,8 +220,5 @@ class CryptoPuzzleCaptcha:
     
     def _count_primes(self, start: int, end: int) -> int:
         """Count prime numbers in range"""
-        count = 0
-        for num in range(max(2, start), end + 1):
-            if all(num % i != 0 for i in range(2, int(num ** 0.5) + 1)):
-                count += 1
-        return count
\ No newline at end of file
+        sieve = _PRIME_SIEVE if end < len(_PRIME_SIEVE) else _build_prime_sieve(end)
+        return sieve.count(1, max(2, start), end + 1)
\ No newline at end of file
@@ -3,37 +3,53 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from fastapi import Request
 import redis
+from cachetools import TTLCache
 from app.core.config import settings
 
-# Create Redis connection for rate limiting (optional)
+# Check Redis is reachable for rate limiting (optional); the probe isn't kept,
+# the limiter storage opens its own pool
 try:
-    redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-    redis_client.ping()
+    _probe = redis.from_url(settings.REDIS_URL, socket_connect_timeout=2)
+    _probe.ping()
+    _probe.close()
     storage_uri = settings.REDIS_URL
 except:
-    redis_client = None
     storage_uri = None  # Will use in-memory storage
 
+# Bounded pool, with idle connections re-checked before use instead of failing a request
+storage_options = {"max_connections": 64, "health_check_interval": 30} if storage_uri else {}
+
 # Create limiter instance
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["1000 per hour"],
-    storage_uri=storage_uri
+    storage_uri=storage_uri,
+    storage_options=storage_options
 )
 
+# Verified token -> bucket key ("" when the token didn't verify); short TTL so
+# expired tokens stop counting as their user soon after they expire
+_token_buckets = TTLCache(maxsize=4096, ttl=60)
+
 # Custom key function for authenticated users
-async def get_user_id_or_ip(request: Request) -> str:
+def get_user_id_or_ip(request: Request) -> str:
     # Try to extract user ID from JWT token
     auth_header = request.headers.get("Authorization", "")
     if auth_header.startswith("Bearer "):
-        token = auth_header.replace("Bearer ", "")
-        try:
-            from app.core.security import decode_token
-            payload = decode_token(token)
-            if payload and "sub" in payload:
-                return f"user:{payload['sub']}"
-        except:
-            pass
+        token = auth_header[7:]
+        bucket = _token_buckets.get(token)
+        if bucket is None:
+            bucket = ""
+            try:
+                from app.core.security import decode_token
+                payload = decode_token(token)
+                if payload and "sub" in payload:
+                    bucket = f"user:{payload['sub']}"
+            except:
+                pass
+            _token_buckets[token] = bucket
+        if bucket:
+            return bucket
     
     # Fall back to IP address
     return get_remote_address(request)
@@ -55,5 +71,5 @@ RATE_LIMITS = {
 }
 
 # Create specific limiters
-auth_limiter = Limiter(key_func=get_remote_address, storage_uri=storage_uri)
-user_limiter = Limiter(key_func=get_user_id_or_ip, storage_uri=storage_uri)
\ No newline at end of file
+auth_limiter = Limiter(key_func=get_remote_address, storage_uri=storage_uri, storage_options=storage_options)
+user_limiter = Limiter(key_func=get_user_id_or_ip, storage_uri=storage_uri, storage_options=storage_options)
\ No newline at end of file
@@ -1,12 +1,31 @@
-from datetime import datetime, timedelta, timezone
+import time
+from datetime import timedelta
 from typing import Optional, Union
 import secrets
-import asyncio
-from jose import JWTError, jwt
+import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# New hashes use Argon2id (low memory, more passes keeps verify well under 100ms);
+# bcrypt hashes still verify and are upgraded on the next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__time_cost=3,
+    argon2__memory_cost=64 * 1024,
+    argon2__parallelism=1,
+    argon2__digest_size=32,
+    argon2__salt_size=16,
+)
+
+# Tokens are signed and verified with JWT_SECRET directly
+_SIGNING_KEY = settings.JWT_SECRET.encode()
+_ALGORITHMS = [settings.JWT_ALGORITHM]
+
+# Token lifetimes in seconds; exp is written as an epoch int, as PyJWT would encode a datetime
+_ACCESS_TTL = settings.JWT_EXPIRATION_HOURS * 3600
+_REFRESH_TTL = settings.JWT_REFRESH_EXPIRATION_DAYS * 86400
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -17,12 +36,16 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
+        expire = int(time.time() + expires_delta.total_seconds())
     else:
-        expire = datetime.now(timezone.utc) + timedelta(hours=settings.JWT_EXPIRATION_HOURS)
+        expire = int(time.time()) + _ACCESS_TTL
     
     # Add unique token ID for revocation
     jti = secrets.token_urlsafe(32)
@@ -32,17 +55,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         "type": "access"
     })
     
-    # Use JWT_SECRET directly for now
-    # TODO: Fix async key management integration
-    signing_key = settings.JWT_SECRET.encode()
-    
-    encoded_jwt = jwt.encode(to_encode, signing_key, algorithm=settings.JWT_ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _SIGNING_KEY, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
 
 def create_refresh_token(data: dict) -> str:
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(days=settings.JWT_REFRESH_EXPIRATION_DAYS)
+    expire = int(time.time()) + _REFRESH_TTL
     
     # Add unique token ID for revocation
     jti = secrets.token_urlsafe(32)
@@ -52,33 +71,13 @@ def create_refresh_token(data: dict) -> str:
         "type": "refresh"
     })
     
-    # Use JWT_SECRET directly for now
-    # TODO: Fix async key management integration
-    signing_key = settings.JWT_SECRET.encode()
-    
-    encoded_jwt = jwt.encode(to_encode, signing_key, algorithm=settings.JWT_ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _SIGNING_KEY, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
 
 def decode_token(token: str) -> dict:
     try:
-        # Get signing key from key management or fallback
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        try:
-            signing_key = loop.run_until_complete(
-                master_key_manager.get_jwt_signing_key()
-            )
-        except Exception as e:
-            print(f"Warning: Could not get key from key management: {e}")
-            # Fallback to config JWT_SECRET
-            signing_key = settings.JWT_SECRET.encode()
-        
-        payload = jwt.decode(token, signing_key, algorithms=[settings.JWT_ALGORITHM])
+        payload = jwt.decode(token, _SIGNING_KEY, algorithms=_ALGORITHMS)
         return payload
-    except JWTError:
+    except jwt.PyJWTError:
         return None
\ No newline at end of file
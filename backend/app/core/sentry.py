@@ -5,6 +5,14 @@ from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 from app.core.config import settings
 import os
 
+# Exception types that are never worth reporting
+DROPPED_EXCEPTION_TYPES = frozenset({"ConnectionError", "ClientDisconnect", "RequestValidationError"})
+
+# Liveness probes, never traced
+UNTRACED_PATHS = frozenset({"/", "/health"})
+
+TRACES_SAMPLE_RATE = 0.1  # 10% of requests
+
 def init_sentry():
     """Initialize Sentry for error tracking"""
     # Only initialize in production
@@ -25,7 +33,7 @@ def init_sentry():
             ],
             
             # Performance monitoring
-            traces_sample_rate=0.1,  # 10% of requests
+            traces_sampler=traces_sampler,
             
             # Release tracking
             release=os.getenv("APP_VERSION", "unknown"),
@@ -41,21 +49,25 @@ def init_sentry():
             send_default_pii=False,  # Don't send personally identifiable information
         )
 
+def traces_sampler(sampling_context):
+    """Sample TRACES_SAMPLE_RATE of requests, skipping liveness probes"""
+    scope = sampling_context.get("asgi_scope")
+    if scope and scope.get("path") in UNTRACED_PATHS:
+        return 0
+    return TRACES_SAMPLE_RATE
+
 def filter_events(event, hint):
     """Filter out certain events from being sent to Sentry"""
-    if "exc_info" in hint:
-        exc_type, exc_value, tb = hint["exc_info"]
+    exc_info = hint.get("exc_info")
+    if exc_info:
+        exc_type, exc_value, tb = exc_info
         
-        # Don't send client disconnections
-        if exc_type.__name__ in ["ConnectionError", "ClientDisconnect"]:
-            return None
-            
-        # Don't send validation errors
-        if exc_type.__name__ == "RequestValidationError":
+        # Don't send client disconnections or validation errors
+        if exc_type.__name__ in DROPPED_EXCEPTION_TYPES:
             return None
             
         # Don't send 404s
-        if hasattr(exc_value, "status_code") and exc_value.status_code == 404:
+        if getattr(exc_value, "status_code", None) == 404:
             return None
     
     return event
\ No newline at end of file
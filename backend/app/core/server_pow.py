@@ -8,6 +8,26 @@ from typing import Tuple, Optional
 import redis
 from app.core.config import settings
 
+# Compact, reused encoder for Redis payloads; json.dumps with non-default
+# separators builds a new JSONEncoder on every call
+_PAYLOAD_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+
+def _fast_sha256(data: bytes) -> bytes:
+    """Raw SHA-256 digest of a single short block (OpenSSL picks SHA-NI when the CPU has it)"""
+    return hashlib.sha256(data).digest()
+
+
+def _verify_pow_core(nonce: str, solution: str, difficulty: int) -> bool:
+    """Pure check that SHA-256(nonce:solution) has `difficulty` leading zero nibbles"""
+    # Difficulty is at most 6 (see _get_difficulty_for_ip), so the target fits in the first 4 bytes
+    if not 0 <= difficulty <= 8:
+        return False
+    digest = _fast_sha256(f"{nonce}:{solution}".encode())
+    # The top 4*difficulty bits must all be clear
+    return int.from_bytes(digest[:4], 'big') >> (32 - 4 * difficulty) == 0
+
+
 class ServerSidePoW:
     """
     Server generates challenge, client solves, server verifies.
@@ -41,7 +61,7 @@ class ServerSidePoW:
             self.redis.setex(
                 f"pow:{challenge_id}",
                 self.challenge_ttl,
-                json.dumps(challenge_data)
+                _PAYLOAD_ENCODER.encode(challenge_data)
             )
         
         # Sign the challenge so client can't tamper
@@ -84,29 +104,21 @@ class ServerSidePoW:
             return False, None
         
         # ACTUAL VERIFICATION - This runs on YOUR server
-        nonce = challenge_data['nonce']
-        difficulty = challenge_data['difficulty']
-        
-        # Compute hash
-        attempt = f"{nonce}:{solution}"
-        hash_result = hashlib.sha256(attempt.encode()).hexdigest()
-        
-        # Verify leading zeros
-        is_valid = hash_result.startswith('0' * difficulty)
+        is_valid = _verify_pow_core(challenge_data['nonce'], solution, challenge_data['difficulty'])
         
         if is_valid:
-            # Mark as used (prevent replay)
+            # Mark as used (prevent replay) and store the access token in one round-trip
             challenge_data['used'] = True
-            if self.redis:
-                self.redis.setex(
-                    f"pow:{challenge_id}",
-                    60,  # Keep for 1 minute after use
-                    json.dumps(challenge_data)
-                )
-        
-        if is_valid:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.setex(
+                f"pow:{challenge_id}",
+                60,  # Keep for 1 minute after use
+                _PAYLOAD_ENCODER.encode(challenge_data)
+            )
+            
             # Generate access token for the resource
-            access_token = self._generate_access_token(ip, resource)
+            access_token = self._generate_access_token(ip, resource, pipe)
+            pipe.execute()
             return True, access_token
         
         return False, None
@@ -114,7 +126,7 @@ class ServerSidePoW:
     def _sign_challenge(self, challenge_id: str, nonce: str, difficulty: int) -> str:
         """Sign challenge to prevent tampering"""
         message = f"{challenge_id}:{nonce}:{difficulty}"
-        return hmac.new(self.secret_key, message.encode(), hashlib.sha256).hexdigest()
+        return hmac.digest(self.secret_key, message.encode(), 'sha256').hex()
     
     def _get_difficulty_for_ip(self, ip: str) -> int:
         """Adaptive difficulty based on behavior"""
@@ -134,22 +146,26 @@ class ServerSidePoW:
         """Record a failed PoW attempt"""
         if self.redis:
             key = f"failures:{ip}"
-            self.redis.incr(key)
-            self.redis.expire(key, 3600)  # Reset after 1 hour
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.incr(key)
+            pipe.expire(key, 3600)  # Reset after 1 hour
+            pipe.execute()
     
-    def _generate_access_token(self, ip: str, resource: str) -> str:
-        """Generate a temporary access token for the resource"""
+    def _generate_access_token(self, ip: str, resource: str, pipe: Optional["redis.client.Pipeline"] = None) -> str:
+        """Generate a temporary access token for the resource (queued on pipe when given)"""
         timestamp = int(time.time())
         token_data = f"{ip}:{resource}:{timestamp}"
-        signature = hmac.new(self.secret_key, token_data.encode(), hashlib.sha256).hexdigest()
+        signature = hmac.digest(self.secret_key, token_data.encode(), 'sha256').hex()
         
         # Store token in Redis with 5-minute expiry
         token = f"{timestamp}:{signature}"
-        if self.redis:
-            self.redis.setex(
+        # An empty pipeline is falsy, so test for None explicitly
+        target = pipe if pipe is not None else self.redis
+        if target is not None:
+            target.setex(
                 f"pow_token:{token}",
                 300,  # 5 minutes
-                json.dumps({
+                _PAYLOAD_ENCODER.encode({
                     'ip': ip,
                     'resource': resource,
                     'timestamp': timestamp
@@ -168,8 +184,10 @@ class ExponentialBackoff:
     def check_and_delay(self, ip: str, resource: str) -> float:
         """Returns required delay in seconds"""
         key = f"attempts:{ip}:{resource}"
-        attempts = self.redis.incr(key)
-        self.redis.expire(key, 3600)  # Reset after 1 hour
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, 3600)  # Reset after 1 hour
+        attempts, _ = pipe.execute()
         
         if attempts <= 3:
             return 0  # First 3 attempts free
@@ -0,0 +1,253 @@
+"""
+SMTP connection pool
+Keeps authenticated SMTP connections open so each email skips TLS + AUTH
+"""
+import asyncio
+import atexit
+import queue
+import smtplib
+import logging
+from email.message import Message
+from typing import List, Optional
+from app.core.config import settings
+
+try:
+    import aiosmtplib
+    AIOSMTPLIB_AVAILABLE = True
+except ImportError:
+    AIOSMTPLIB_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Port that speaks TLS from the first byte; any other port upgrades with STARTTLS
+SMTP_SSL_PORT = 465
+
+# Bulk sends give up once more than a third of a batch of at least this size is rejected
+BATCH_ABORT_MIN_SIZE = 30
+
+
+class BatchAbort(Exception):
+    """Too many recipients in a bulk send were rejected"""
+
+
+def _check_batch_abort(failures: int, total: int):
+    if total >= BATCH_ABORT_MIN_SIZE and failures * 3 > total:
+        raise BatchAbort(f"{failures} of {total} messages rejected, aborting batch")
+
+
+class SMTPPool:
+    """Per-process pool of logged-in SMTP connections"""
+
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 max_size: int = 5, timeout: int = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._q = queue.LifoQueue(max_size)
+
+    def _connect(self) -> smtplib.SMTP:
+        """Open and authenticate a new connection"""
+        if self.port == SMTP_SSL_PORT:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password)
+        return conn
+
+    def acquire(self) -> smtplib.SMTP:
+        """Borrow an idle connection or open a new one"""
+        try:
+            return self._q.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn: smtplib.SMTP):
+        """Return a connection to the pool if it's still healthy"""
+        try:
+            code, _ = conn.noop()
+        except (smtplib.SMTPException, OSError):
+            code = None
+
+        if code == 250:
+            try:
+                self._q.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+
+        self._close(conn)
+
+    def send_message(self, msg: Message):
+        """Send a message over a pooled connection, reconnecting once if it dropped"""
+        conn = self.acquire()
+        try:
+            try:
+                conn.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self._close(conn)
+                conn = self._connect()
+                conn.send_message(msg)
+        finally:
+            self.release(conn)
+
+    def send_many(self, messages: List[Message]) -> int:
+        """Send a batch over one connection; returns the number delivered"""
+        failures = 0
+        conn = self.acquire()
+        try:
+            for msg in messages:
+                try:
+                    conn.send_message(msg)
+                except smtplib.SMTPRecipientsRefused:
+                    failures += 1
+                    _check_batch_abort(failures, len(messages))
+        finally:
+            self.release(conn)
+        return len(messages) - failures
+
+    def warm(self, count: int):
+        """Open up to count connections ahead of the first send"""
+        while self._q.qsize() < count:
+            conn = self._connect()
+            try:
+                self._q.put_nowait(conn)
+            except queue.Full:
+                self._close(conn)
+                return
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._q.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+
+class AsyncSMTPPool:
+    """Pool of aiosmtplib connections so concurrent sends don't queue behind one session"""
+
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 max_size: int = 5, timeout: int = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._idle: List["aiosmtplib.SMTP"] = []
+        # One SMTP session handles one transaction at a time, so at most
+        # max_size sends run at once and each holds its connection exclusively
+        self._slots = asyncio.Semaphore(max_size)
+        self.max_size = max_size
+
+    async def _connect(self) -> "aiosmtplib.SMTP":
+        """Open and authenticate a new connection"""
+        use_tls = self.port == SMTP_SSL_PORT
+        smtp = aiosmtplib.SMTP(
+            hostname=self.host, port=self.port, use_tls=use_tls,
+            start_tls=not use_tls, timeout=self.timeout
+        )
+        await smtp.connect()
+        if self.username:
+            await smtp.login(self.username, self.password)
+        return smtp
+
+    async def _acquire(self) -> "aiosmtplib.SMTP":
+        """Borrow an idle connection or open a new one; caller holds a slot"""
+        while self._idle:
+            smtp = self._idle.pop()
+            if smtp.is_connected:
+                return smtp
+        return await self._connect()
+
+    async def _release(self, smtp: "aiosmtplib.SMTP"):
+        """Return a connection to the pool if it's still usable"""
+        if smtp.is_connected:
+            self._idle.append(smtp)
+        else:
+            await self._close(smtp)
+
+    async def warm(self, count: int):
+        """Open up to count connections ahead of the first send"""
+        count = min(count, self.max_size)
+        while len(self._idle) < count:
+            self._idle.append(await self._connect())
+
+    async def send_message(self, msg: Message):
+        """Send a message over a pooled connection, reconnecting once if it dropped"""
+        async with self._slots:
+            smtp = await self._acquire()
+            try:
+                try:
+                    await smtp.send_message(msg)
+                except aiosmtplib.SMTPServerDisconnected:
+                    await self._close(smtp)
+                    smtp = await self._connect()
+                    await smtp.send_message(msg)
+            finally:
+                await self._release(smtp)
+
+    async def send_many(self, messages: List[Message]) -> int:
+        """Send a batch over one connection; returns the number delivered"""
+        failures = 0
+        async with self._slots:
+            smtp = await self._acquire()
+            try:
+                for msg in messages:
+                    try:
+                        await smtp.send_message(msg)
+                    except aiosmtplib.SMTPRecipientsRefused:
+                        failures += 1
+                        _check_batch_abort(failures, len(messages))
+            finally:
+                await self._release(smtp)
+        return len(messages) - failures
+
+    async def close(self):
+        """Close every idle connection"""
+        while self._idle:
+            await self._close(self._idle.pop())
+
+    @staticmethod
+    async def _close(smtp: "aiosmtplib.SMTP"):
+        if smtp.is_connected:
+            try:
+                await smtp.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                smtp.close()
+
+
+# Global instances (None when SMTP isn't configured)
+smtp_pool: Optional[SMTPPool] = None
+async_smtp: Optional[AsyncSMTPPool] = None
+
+if settings.SMTP_HOST:
+    if AIOSMTPLIB_AVAILABLE:
+        async_smtp = AsyncSMTPPool(
+            settings.SMTP_HOST,
+            settings.SMTP_PORT,
+            settings.SMTP_USERNAME,
+            settings.SMTP_PASSWORD,
+            max_size=settings.SMTP_POOL_SIZE
+        )
+    else:
+        smtp_pool = SMTPPool(
+            settings.SMTP_HOST,
+            settings.SMTP_PORT,
+            settings.SMTP_USERNAME,
+            settings.SMTP_PASSWORD,
+            max_size=settings.SMTP_POOL_SIZE
+        )
+        atexit.register(smtp_pool.close_all)
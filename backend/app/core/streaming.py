@@ -2,76 +2,107 @@
 Streaming file upload utilities to prevent memory DoS
 """
 
+import io
 import os
+import asyncio
 import tempfile
 import hashlib
 from typing import AsyncIterator, Tuple, Optional
 from fastapi import UploadFile
 import aiofiles
-import magic
+from app.core.validators import FileValidator, get_mime_detector
 
 
 class StreamingFileHandler:
     """Handle large file uploads with streaming to prevent memory exhaustion"""
     
-    CHUNK_SIZE = 1024 * 1024  # 1MB chunks
+    CHUNK_SIZE = 8 * 1024 * 1024  # 8MB chunks
     MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB - files smaller than this stay in memory
+    WRITE_BUFFER_SIZE = 8 * 1024 * 1024  # Chunks are flushed to the temp file 8MB at a time
     
     @staticmethod
     async def process_upload_stream(
         file: UploadFile,
         max_size: int
-    ) -> Tuple[str, int, str, bytes]:
+    ) -> Tuple[Optional[str], int, str, bytes, Optional[bytes]]:
         """
         Process file upload in chunks
-        Returns: (temp_file_path, file_size, mime_type, first_chunk_for_validation)
+        Returns: (temp_file_path, file_size, mime_type, first_chunk_for_validation, file_data)
+        
+        Uploads smaller than MAX_MEMORY_SIZE never touch disk: temp_file_path is None
+        and file_data holds the content. Larger uploads spill to a temporary file once
+        they cross the threshold, and file_data is None.
         """
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        temp_path = temp_file.name
+        temp_file = None
+        temp_path = None
         
         hasher = hashlib.sha256()
         total_size = 0
         first_chunk = None
         
+        # Buffer chunks in memory; once spilled, flush them to the temp file so a
+        # large upload costs one executor hop per WRITE_BUFFER_SIZE instead of per chunk
+        loop = asyncio.get_running_loop()
+        pending = bytearray()
+        
         try:
             # Read and write in chunks
-            async with aiofiles.open(temp_path, 'wb') as f:
-                while True:
-                    chunk = await file.read(StreamingFileHandler.CHUNK_SIZE)
-                    if not chunk:
-                        break
-                    
-                    # Store first chunk for MIME type detection
-                    if first_chunk is None:
-                        first_chunk = chunk[:8192]  # First 8KB for magic bytes
-                    
-                    # Check size limit
-                    total_size += len(chunk)
-                    if total_size > max_size:
-                        os.unlink(temp_path)
-                        raise ValueError(f"File size exceeds limit of {max_size} bytes")
-                    
-                    # Update hash
-                    hasher.update(chunk)
-                    
-                    # Write to temp file
-                    await f.write(chunk)
+            while True:
+                chunk = await file.read(StreamingFileHandler.CHUNK_SIZE)
+                if not chunk:
+                    break
+                
+                # Store first chunk for MIME type detection
+                if first_chunk is None:
+                    first_chunk = chunk[:8192]  # First 8KB for magic bytes
+                
+                # Check size limit
+                total_size += len(chunk)
+                if total_size > max_size:
+                    raise ValueError(f"File size exceeds limit of {max_size} bytes")
+                
+                # Update hash
+                hasher.update(chunk)
+                
+                pending += chunk
+                if temp_file is None:
+                    if len(pending) < StreamingFileHandler.MAX_MEMORY_SIZE:
+                        continue
+                    # Too big to keep in memory - spill to a temporary file
+                    temp_file = tempfile.NamedTemporaryFile(delete=False)
+                    temp_path = temp_file.name
+                elif len(pending) < StreamingFileHandler.WRITE_BUFFER_SIZE:
+                    continue
+                
+                # Write to temp file
+                await loop.run_in_executor(None, temp_file.write, pending)
+                pending.clear()
+            
+            file_data = None
+            if temp_file is None:
+                file_data = bytes(pending)
+            else:
+                if pending:
+                    await loop.run_in_executor(None, temp_file.write, pending)
+                await loop.run_in_executor(None, temp_file.close)
             
             # Detect MIME type from first chunk
             if first_chunk:
-                mime = magic.Magic(mime=True)
-                mime_type = mime.from_buffer(first_chunk)
+                mime_type = get_mime_detector().from_buffer(first_chunk)
             else:
                 mime_type = "application/octet-stream"
             
-            return temp_path, total_size, mime_type, first_chunk
+            return temp_path, total_size, mime_type, first_chunk, file_data
             
         except Exception as e:
             # Clean up temp file on error
-            if os.path.exists(temp_path):
+            if temp_path and os.path.exists(temp_path):
                 os.unlink(temp_path)
             raise e
+        
+        finally:
+            if temp_file is not None:
+                temp_file.close()
     
     @staticmethod
     async def read_file_chunks(
@@ -97,10 +128,11 @@ class StreamingFileHandler:
     
     @staticmethod
     async def validate_file_stream(
-        temp_path: str,
+        temp_path: Optional[str],
         filename: str,
         mime_type: str,
-        first_chunk: bytes
+        first_chunk: bytes,
+        file_data: Optional[bytes] = None
     ) -> Tuple[bool, Optional[str]]:
         """
         Validate file without loading entire content into memory
@@ -127,6 +159,14 @@ class StreamingFileHandler:
         if ext in executable_extensions:
             return False, f"File type {ext} is not allowed"
         
+        # Zip bomb / path traversal checks straight from the temp file (or memory)
+        if mime_type in FileValidator.ARCHIVE_MIME_TYPES:
+            source = temp_path if file_data is None else io.BytesIO(file_data)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, FileValidator.validate_archive_path, source, mime_type
+            )
+        
         return True, None
 
 
@@ -136,12 +176,20 @@ class ChunkedStorageUploader:
     @staticmethod
     async def upload_from_temp_file(
         storage_service,
-        temp_path: str,
+        temp_path: Optional[str],
         stored_filename: str,
-        mime_type: str
+        mime_type: str,
+        file_data: Optional[bytes] = None
     ) -> bool:
-        """Upload file from temporary path to storage service"""
+        """Upload file from temporary path to storage service
+        
+        Small uploads kept in memory by process_upload_stream are passed as file_data
+        (temp_path is then None) and go straight to the storage service.
+        """
         try:
+            if file_data is not None:
+                return await storage_service.upload_file(file_data, stored_filename, mime_type)
+            
             # For S3/R2, we can use multipart upload for large files
             file_size = os.path.getsize(temp_path)
             
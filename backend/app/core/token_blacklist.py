@@ -4,15 +4,35 @@ Implements token revocation by maintaining a blacklist in Redis
 """
 
 import json
+import time
 from datetime import datetime, timezone
 from typing import Optional, Set
 import redis.asyncio as redis
 from app.core.config import settings
 
+# Compact separators keep blacklist entries small in Redis
+_PAYLOAD_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+# Re-blacklist every token in a user's set with its remaining TTL, in one round-trip.
+# KEYS[1] = user token set, ARGV[1] = blacklist key prefix, ARGV[2] = entry payload
+_REVOKE_ALL_LUA = """
+local revoked = 0
+for _, jti in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local key = ARGV[1] .. jti
+    local ttl = redis.call('TTL', key)
+    if ttl > 0 then
+        redis.call('SETEX', key, ttl, ARGV[2])
+        revoked = revoked + 1
+    end
+end
+return revoked
+"""
+
 
 class TokenBlacklist:
     def __init__(self):
         self.redis_client = None
+        self._revoke_all_script = None
         self.prefix = "token_blacklist:"
         self.user_tokens_prefix = "user_tokens:"
     
@@ -27,6 +47,7 @@ class TokenBlacklist:
                 )
                 # Test connection
                 await self.redis_client.ping()
+                self._revoke_all_script = self.redis_client.register_script(_REVOKE_ALL_LUA)
             except Exception as e:
                 print(f"Warning: Could not connect to Redis for token blacklist: {e}")
                 self.redis_client = None
@@ -46,30 +67,36 @@ class TokenBlacklist:
             return
         
         # Calculate TTL based on token expiration
-        ttl = int((exp - datetime.now(timezone.utc)).total_seconds())
+        now = datetime.now(timezone.utc)
+        ttl = int((exp - now).total_seconds())
         
         if ttl > 0:
-            # Add to blacklist with expiration
-            await self.redis_client.setex(
-                f"{self.prefix}{jti}",
-                ttl,
-                json.dumps({
-                    "user_id": user_id,
-                    "revoked_at": datetime.now(timezone.utc).isoformat()
-                })
-            )
-            
-            # Track token for user (for logout all functionality)
-            await self.redis_client.sadd(
-                f"{self.user_tokens_prefix}{user_id}",
-                jti
-            )
-            
-            # Set expiration on user token set
-            await self.redis_client.expire(
-                f"{self.user_tokens_prefix}{user_id}",
-                ttl
-            )
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                # Add to blacklist with expiration; a jti that is already
+                # blacklisted keeps its original entry
+                pipe.set(
+                    f"{self.prefix}{jti}",
+                    _PAYLOAD_ENCODER.encode({
+                        "user_id": user_id,
+                        "revoked_at": int(now.timestamp())  # Unix seconds
+                    }),
+                    ex=ttl,
+                    nx=True
+                )
+                
+                # Track token for user (for logout all functionality)
+                pipe.sadd(
+                    f"{self.user_tokens_prefix}{user_id}",
+                    jti
+                )
+                
+                # Set expiration on user token set. Not NX: the set must outlive
+                # the newest token, or revoke_all_user_tokens would miss it
+                pipe.expire(
+                    f"{self.user_tokens_prefix}{user_id}",
+                    ttl
+                )
+                await pipe.execute()
     
     async def is_blacklisted(self, jti: str) -> bool:
         """Check if a token is blacklisted"""
@@ -86,26 +113,18 @@ class TokenBlacklist:
         """Revoke all tokens for a specific user"""
         await self.connect()
         
-        # Get all token JTIs for the user
-        token_jtis = await self.redis_client.smembers(
-            f"{self.user_tokens_prefix}{user_id}"
+        # Add each of the user's tokens to the blacklist server-side, atomically
+        await self._revoke_all_script(
+            keys=[f"{self.user_tokens_prefix}{user_id}"],
+            args=[
+                self.prefix,
+                _PAYLOAD_ENCODER.encode({
+                    "user_id": user_id,
+                    "revoked_at": int(time.time()),
+                    "revoked_all": True
+                })
+            ]
         )
-        
-        # Add each token to blacklist
-        for jti in token_jtis:
-            # Get remaining TTL
-            ttl = await self.redis_client.ttl(f"{self.prefix}{jti}")
-            
-            if ttl > 0:
-                await self.redis_client.setex(
-                    f"{self.prefix}{jti}",
-                    ttl,
-                    json.dumps({
-                        "user_id": user_id,
-                        "revoked_at": datetime.now(timezone.utc).isoformat(),
-                        "revoked_all": True
-                    })
-                )
     
     async def get_blacklist_info(self, jti: str) -> Optional[dict]:
         """Get information about a blacklisted token"""
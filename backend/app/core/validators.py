@@ -1,13 +1,21 @@
 import os
-import re
+import string
+import functools
 import magic
-from typing import Tuple, Optional
+from typing import BinaryIO, Tuple, Optional, Union
 import zipfile
 import tarfile
 from pydantic import BaseModel, field_validator, constr, conint
 import bleach
 
 
+@functools.cache
+def get_mime_detector() -> magic.Magic:
+    """Shared libmagic handle; loading the magic database is the expensive part, and
+    Magic serialises its own calls with an internal lock"""
+    return magic.Magic(mime=True)
+
+
 class FileValidator:
     BLOCKED_EXTENSIONS = {
         '.exe', '.bat', '.cmd', '.com', '.pif', '.scr', '.vbs', 
@@ -51,8 +59,16 @@ class FileValidator:
         b'\x4D\x5A': 'application/x-msdownload',  # Executable - should be blocked
     }
     
+    # Distinct signature lengths, longest first, so detect_signature does one dict
+    # lookup per length instead of comparing against every signature
+    _SIGNATURE_LENGTHS = tuple(sorted({len(sig) for sig in FILE_SIGNATURES}, reverse=True))
+    
     MAX_DECOMPRESSED_SIZE = 1024 * 1024 * 1024  # 1GB max when decompressed
     
+    ARCHIVE_MIME_TYPES = frozenset({
+        'application/zip', 'application/x-rar-compressed', 'application/x-7z-compressed', 'application/gzip'
+    })
+    
     @classmethod
     def validate_file(cls, file_content: bytes, filename: str, claimed_mime_type: str) -> Tuple[bool, Optional[str]]:
         # Allow ALL file types - no restrictions
@@ -61,10 +77,10 @@ class FileValidator:
         
         # Only check for zip bombs in compressed files for safety
         try:
-            mime = magic.Magic(mime=True)
-            detected_mime = mime.from_buffer(file_content)
+            # Known magic bytes answer without going through libmagic
+            detected_mime = cls.detect_signature(file_content) or get_mime_detector().from_buffer(file_content)
             
-            if detected_mime in ['application/zip', 'application/x-rar-compressed', 'application/x-7z-compressed', 'application/gzip']:
+            if detected_mime in cls.ARCHIVE_MIME_TYPES:
                 is_safe, msg = cls._check_archive_safety(file_content, detected_mime)
                 if not is_safe:
                     return False, msg
@@ -74,13 +90,31 @@ class FileValidator:
         
         return True, None
     
+    @classmethod
+    def detect_signature(cls, data: bytes) -> Optional[str]:
+        """MIME type from FILE_SIGNATURES for data's leading bytes, or None"""
+        for length in cls._SIGNATURE_LENGTHS:
+            mime_type = cls.FILE_SIGNATURES.get(data[:length])
+            if mime_type:
+                return mime_type
+        return None
+    
+    @classmethod
+    def validate_archive_path(cls, path: Union[str, BinaryIO], mime_type: str) -> Tuple[bool, Optional[str]]:
+        """Archive checks on a file on disk (or a seekable file object); zipfile seeks
+        to the central directory, so the archive body is never loaded into memory"""
+        return cls._check_archive_source(path, mime_type)
+    
     @classmethod
     def _check_archive_safety(cls, file_content: bytes, mime_type: str) -> Tuple[bool, Optional[str]]:
+        import io
+        return cls._check_archive_source(io.BytesIO(file_content), mime_type)
+    
+    @classmethod
+    def _check_archive_source(cls, source, mime_type: str) -> Tuple[bool, Optional[str]]:
         try:
-            import io
-            
             if mime_type == 'application/zip':
-                with zipfile.ZipFile(io.BytesIO(file_content)) as zf:
+                with zipfile.ZipFile(source) as zf:
                     total_size = sum(info.file_size for info in zf.infolist())
                     if total_size > cls.MAX_DECOMPRESSED_SIZE:
                         return False, "Archive decompresses to excessive size (possible zip bomb)"
@@ -107,20 +141,23 @@ class FileValidator:
         )
 
 
+# ASCII translation table for filenames: path separators become '_', anything
+# outside [a-zA-Z0-9._- ] (including null bytes) is dropped
+_FILENAME_ALLOWED = frozenset(string.ascii_letters + string.digits + '._- ')
+_FILENAME_TRANS = {i: None for i in range(128) if chr(i) not in _FILENAME_ALLOWED}
+_FILENAME_TRANS[ord('/')] = ord('_')
+_FILENAME_TRANS[ord('\\')] = ord('_')
+
+
 class FilenameValidator:
     @staticmethod
     def sanitize_filename(filename: str) -> str:
         # Remove path components
         filename = os.path.basename(filename)
         
-        # Remove null bytes
-        filename = filename.replace('\x00', '')
-        
-        # Replace path separators
-        filename = filename.replace('/', '_').replace('\\', '_')
-        
-        # Allow only safe characters
-        filename = re.sub(r'[^a-zA-Z0-9._\- ]', '', filename)
+        # Allow only safe characters: non-ASCII is dropped by the encode, the rest
+        # is stripped or remapped in one translate pass
+        filename = filename.encode('ascii', 'ignore').decode('ascii').translate(_FILENAME_TRANS)
         
         # Prevent hidden files
         if filename.startswith('.'):
@@ -146,6 +183,10 @@ class PasswordValidator:
     REQUIRE_NUMBERS = True
     REQUIRE_SPECIAL = True
     
+    _UPPER = frozenset(string.ascii_uppercase)
+    _LOWER = frozenset(string.ascii_lowercase)
+    _SPECIAL = frozenset('!@#$%^&*(),.?":{}|<>')
+    
     @classmethod
     def validate_password(cls, password: str, is_file_password: bool = False) -> Tuple[bool, Optional[str]]:
         # For file passwords, only check minimum length
@@ -158,16 +199,20 @@ class PasswordValidator:
         if len(password) < cls.MIN_LENGTH:
             return False, f"Password must be at least {cls.MIN_LENGTH} characters long"
         
-        if cls.REQUIRE_UPPERCASE and not re.search(r'[A-Z]', password):
+        # One pass to collect the distinct characters, then set tests per rule
+        chars = set(password)
+        
+        if cls.REQUIRE_UPPERCASE and cls._UPPER.isdisjoint(chars):
             return False, "Password must contain at least one uppercase letter"
         
-        if cls.REQUIRE_LOWERCASE and not re.search(r'[a-z]', password):
+        if cls.REQUIRE_LOWERCASE and cls._LOWER.isdisjoint(chars):
             return False, "Password must contain at least one lowercase letter"
         
-        if cls.REQUIRE_NUMBERS and not re.search(r'\d', password):
+        # isdecimal matches exactly what \d does for str patterns
+        if cls.REQUIRE_NUMBERS and not any(map(str.isdecimal, chars)):
             return False, "Password must contain at least one number"
         
-        if cls.REQUIRE_SPECIAL and not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+        if cls.REQUIRE_SPECIAL and cls._SPECIAL.isdisjoint(chars):
             return False, "Password must contain at least one special character"
         
         return True, None
@@ -196,7 +241,9 @@ class FileUploadRequest(BaseModel):
 
 
 class UserRegisterRequest(BaseModel):
-    email: constr(pattern=r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+    # pydantic-core compiles the pattern once into Rust's linear-time regex engine;
+    # the length cap (RFC 5321 path limit) is checked first and bounds the match
+    email: constr(max_length=254, pattern=r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
     password: constr(min_length=8, max_length=128)
     
     @field_validator('password', mode='after')
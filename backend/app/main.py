@@ -10,6 +10,8 @@ from app.core.rate_limiting import limiter, _rate_limit_exceeded_handler
 # CSP nonce temporarily disabled until frontend supports it
 # from app.core.csp_nonce import CSPNonce, add_csp_nonce_to_request
 from app.core.token_blacklist import token_blacklist
+from app.core.encryption import file_encryption
+from app.core.email import EmailService
 from app.core.sentry import init_sentry
 from slowapi.errors import RateLimitExceeded
 
@@ -23,9 +25,17 @@ async def lifespan(app: FastAPI):
     # Initialize token blacklist
     await token_blacklist.connect()
     
+    # Load the file encryption master key so file keys derive locally
+    if file_encryption:
+        await file_encryption.load_master_key()
+    
+    # Compile-touch email templates and open SMTP connections
+    await EmailService.warmup()
+    
     yield
     
     # Cleanup
+    await EmailService.shutdown()
     await token_blacklist.close()
 
 
@@ -74,6 +84,7 @@ async def add_security_headers(request: Request, call_next):
     csp_directives = [
         "default-src 'self'",
         "script-src 'self' 'unsafe-inline' 'unsafe-eval'",  # Allow inline scripts for now
+        "worker-src 'self' blob:",  # PoW challenge solver workers
         "style-src 'self' 'unsafe-inline'",  # Allow inline styles for now
         "img-src 'self' data: https:",
         "font-src 'self'",
@@ -3,6 +3,7 @@ from app.core.config import settings
 from app.core.encryption import file_encryption
 from datetime import timedelta
 import os
+import tempfile
 import aiofiles
 import asyncio
 
@@ -28,7 +29,7 @@ class MockStorageService:
         try:
             # Encrypt file data if encryption is available
             if file_encryption:
-                file_data = file_encryption.encrypt_file(file_data, stored_filename)
+                file_data = await file_encryption.encrypt_file_async(file_data, stored_filename)
             
             file_path = os.path.join(self.storage_path, stored_filename)
             async with aiofiles.open(file_path, 'wb') as f:
@@ -69,7 +70,7 @@ class MockStorageService:
             
             # Decrypt file data if encryption is available
             if file_encryption:
-                file_data = file_encryption.decrypt_file(file_data, stored_filename)
+                file_data = await file_encryption.decrypt_file_async(file_data, stored_filename)
             
             return file_data
         except Exception as e:
@@ -81,6 +82,11 @@ class MockStorageService:
         try:
             dest_path = os.path.join(self.storage_path, stored_filename)
             
+            # Encrypt frame by frame straight from disk
+            if file_encryption:
+                await file_encryption.encrypt_path_async(file_path, dest_path, stored_filename)
+                return True
+            
             # Read and write in chunks
             chunk_size = 10 * 1024 * 1024  # 10MB chunks
             
@@ -90,22 +96,54 @@ class MockStorageService:
                         chunk = await src.read(chunk_size)
                         if not chunk:
                             break
-                        
-                        # Encrypt chunk if needed
-                        if file_encryption:
-                            chunk = file_encryption.encrypt_file(chunk, f"{stored_filename}_chunk")
-                        
                         await dst.write(chunk)
             
             return True
         except Exception as e:
             print(f"Multipart upload failed: {e}")
             return False
+
+
+class StorageService:
+    def __init__(self):
+        self.s3_client = boto3.client(
+            's3',
+            endpoint_url=settings.R2_ENDPOINT,
+            aws_access_key_id=settings.R2_ACCESS_KEY,
+            aws_secret_access_key=settings.R2_SECRET_KEY,
+            region_name='auto'
+        )
+        self.bucket = settings.R2_BUCKET
+        self.multipart_threshold = 100 * 1024 * 1024  # 100MB
+    
+    async def upload_file(self, file_data: bytes, stored_filename: str, content_type: str) -> bool:
+        try:
+            # Encrypt file data if encryption is available
+            if file_encryption:
+                file_data = await file_encryption.encrypt_file_async(file_data, stored_filename)
+            
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=stored_filename,
+                Body=file_data,
+                ContentType=content_type
+            )
+            return True
+        except ClientError:
+            return False
     
     async def upload_file_multipart(self, file_path: str, stored_filename: str, content_type: str) -> bool:
         """Upload large file using multipart upload"""
+        upload_id = None
+        encrypted_path = None
         try:
-            file_size = os.path.getsize(file_path)
+            # Encrypt frame by frame into a temp file, so the upload never holds
+            # more than one part in memory
+            if file_encryption:
+                with tempfile.NamedTemporaryFile(delete=False) as tmp:
+                    encrypted_path = tmp.name
+                await file_encryption.encrypt_path_async(file_path, encrypted_path, stored_filename)
+                file_path = encrypted_path
             
             # Initiate multipart upload
             response = self.s3_client.create_multipart_upload(
@@ -126,10 +164,6 @@ class MockStorageService:
                     if not data:
                         break
                     
-                    # Encrypt part if needed
-                    if file_encryption:
-                        data = file_encryption.encrypt_file(data, f"{stored_filename}_part{part_number}")
-                    
                     response = self.s3_client.upload_part(
                         Bucket=self.bucket,
                         Key=stored_filename,
@@ -158,44 +192,20 @@ class MockStorageService:
         except Exception as e:
             print(f"Multipart upload failed: {e}")
             # Abort multipart upload on failure
-            try:
-                self.s3_client.abort_multipart_upload(
-                    Bucket=self.bucket,
-                    Key=stored_filename,
-                    UploadId=upload_id
-                )
-            except:
-                pass
-            return False
-
-
-class StorageService:
-    def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            endpoint_url=settings.R2_ENDPOINT,
-            aws_access_key_id=settings.R2_ACCESS_KEY,
-            aws_secret_access_key=settings.R2_SECRET_KEY,
-            region_name='auto'
-        )
-        self.bucket = settings.R2_BUCKET
-        self.multipart_threshold = 100 * 1024 * 1024  # 100MB
-    
-    async def upload_file(self, file_data: bytes, stored_filename: str, content_type: str) -> bool:
-        try:
-            # Encrypt file data if encryption is available
-            if file_encryption:
-                file_data = file_encryption.encrypt_file(file_data, stored_filename)
-            
-            self.s3_client.put_object(
-                Bucket=self.bucket,
-                Key=stored_filename,
-                Body=file_data,
-                ContentType=content_type
-            )
-            return True
-        except ClientError:
+            if upload_id:
+                try:
+                    self.s3_client.abort_multipart_upload(
+                        Bucket=self.bucket,
+                        Key=stored_filename,
+                        UploadId=upload_id
+                    )
+                except:
+                    pass
             return False
+        
+        finally:
+            if encrypted_path and os.path.exists(encrypted_path):
+                os.unlink(encrypted_path)
     
     def generate_presigned_upload_url(self, stored_filename: str, content_type: str, expires_in: int = 3600) -> str:
         try:
@@ -257,7 +267,7 @@ class StorageService:
             
             # Decrypt file data if encryption is available
             if file_encryption:
-                file_data = file_encryption.decrypt_file(file_data, stored_filename)
+                file_data = await file_encryption.decrypt_file_async(file_data, stored_filename)
             
             return file_data
         except ClientError:
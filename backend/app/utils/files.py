@@ -3,8 +3,8 @@ import hashlib
 import time
 import os
 from typing import Tuple
-import magic
 import mimetypes
+from app.core.validators import get_mime_detector
 
 
 def generate_short_code() -> str:
@@ -27,7 +27,6 @@ def generate_stored_filename(original_filename: str) -> str:
 
 
 def validate_file_type(file_content: bytes, filename: str) -> Tuple[bool, str]:
-    mime = magic.Magic(mime=True)
-    detected_mime = mime.from_buffer(file_content)
+    detected_mime = get_mime_detector().from_buffer(file_content)
     
     guessed_mime = mimetypes.guess_type(filename)[0]
\ No newline at end of file